@@ -41,7 +41,8 @@ INSTALLED_APPS = [
     'investments.apps.InvestmentsConfig',
     'account.apps.AccountConfig',
     'crispy_forms',
-    'django_select2'
+    'django_select2',
+    'rest_framework'
 ]
 
 MIDDLEWARE = [
@@ -143,6 +144,17 @@ USE_TZ = True
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'investments.pagination.PkCursorPagination',
+    'PAGE_SIZE': 50
+}
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
 
@@ -151,6 +163,47 @@ STATIC_URL = '/static/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Seconds to wait for more edits of a portfolio before its graphs are redrawn, 0 redraws synchronously
+GRAPH_REGENERATION_DELAY = 2
+
+# Pie graphs show at most GRAPH_MAX_SLICES slices, smaller ones are folded into 'Other'
+GRAPH_MAX_SLICES = 12
+GRAPH_MIN_SLICE_SHARE = 0.01
+
+# 'investments.svg_renderer.SvgPieRenderer' draws light vector graphs without matplotlib
+GRAPH_RENDERER = 'investments.matplotlib_renderer.MatplotlibPieRenderer'
+GRAPH_SVG_DONUT = False
+# Draw all five breakdowns as one graph file instead of five
+GRAPH_COMPOSITE = False
+# Widths of compressed WebP (and AVIF if enabled and supported by Pillow) copies of PNG graphs
+GRAPH_VARIANT_WIDTHS = (320, 480, 640)
+GRAPH_AVIF = False
+
+# Graph files are handed off to the web server: 'X-Accel-Redirect' for nginx, 'X-Sendfile' for apache,
+# unset serves them by django. nginx needs an internal location GRAPH_ACCEL_REDIRECT_ROOT aliased to MEDIA_ROOT
+GRAPH_SENDFILE_HEADER = os.getenv('GRAPH_SENDFILE_HEADER')
+GRAPH_ACCEL_REDIRECT_ROOT = '/protected-media/'
+
+# Seconds a price stays fresh while its exchange is open, closed exchanges keep the price after the last close
+PRICE_INTRADAY_TTL = {'stock': 15 * 60, 'etf': 15 * 60, 'bond': 60 * 60}
+# Exchange holidays besides weekends: {'NYSE': ['2022-12-26', ...], 'MOEX': [...], 'XETRA': [...]}
+MARKET_HOLIDAYS = {}
+
+# Streamed prices (manage.py stream_prices) are saved every flush interval, held FIGIs are re-read every
+# reconcile interval and prices are shared with web processes through the cache for LIVE_PRICE_TIMEOUT
+PRICE_STREAM_FLUSH_INTERVAL = 10
+PRICE_STREAM_RECONCILE_INTERVAL = 60
+LIVE_PRICE_TIMEOUT = 15 * 60
+
+# Calls to exchangerate-api, Tinvest and yfapi time out after PROVIDER_TIMEOUT (connect, read) seconds. A provider
+# circuit opens when CIRCUIT_BREAKER_FAILURE_RATE of at least CIRCUIT_BREAKER_MIN_CALLS calls in CIRCUIT_BREAKER_WINDOW
+# seconds fail, then one probe call is let through every CIRCUIT_BREAKER_OPEN_TIMEOUT seconds
+PROVIDER_TIMEOUT = (3.05, 5)
+CIRCUIT_BREAKER_FAILURE_RATE = 0.5
+CIRCUIT_BREAKER_MIN_CALLS = 4
+CIRCUIT_BREAKER_WINDOW = 60
+CIRCUIT_BREAKER_OPEN_TIMEOUT = 30
+
 EXCHANGE_API_KEY = os.getenv('EXCHANGE_RATE_API_KEY')
 TINVEST_TOKEN = os.getenv('TINVEST_TOKEN')
 YAHOO_API_KEY = os.getenv('YAHOO_FINANCE_API_KEY')
@@ -0,0 +1,7 @@
+# Tests run without Redis: python manage.py test --settings=config.test_settings
+from .settings import *  # noqa: F401,F403
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+    "select2": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "select2"},
+}
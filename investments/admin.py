@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Security, ExchangeRate, Portfolio, PortfolioItem
+from .catalog import bump_security_catalog_version
+from .models import Security, SecurityPriceHistory, ExchangeRate, ExchangeRateHistory, Portfolio, PortfolioItem
 
 
 class SecurityAdmin(admin.ModelAdmin):
@@ -7,16 +8,42 @@ class SecurityAdmin(admin.ModelAdmin):
 
     list_filter = ['sector', 'not_found_on_market']
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        bump_security_catalog_version()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        bump_security_catalog_version()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        bump_security_catalog_version()
+
+
+class SecurityPriceHistoryAdmin(admin.ModelAdmin):
+    list_display = ('security', 'date', 'close_price')
+
+    list_filter = ['date']
+
 
 class ExchangeRateAdmin(admin.ModelAdmin):
     list_display = ('last_updated', 'eur_rate', 'rub_rate')
 
 
+class ExchangeRateHistoryAdmin(admin.ModelAdmin):
+    list_display = ('date', 'currency', 'rate')
+
+    list_filter = ['currency']
+
+
 class PortfolioAdmin(admin.ModelAdmin):
     list_display = ('investor', 'name')
 
 
 admin.site.register(Security, SecurityAdmin)
+admin.site.register(SecurityPriceHistory, SecurityPriceHistoryAdmin)
 admin.site.register(ExchangeRate, ExchangeRateAdmin)
+admin.site.register(ExchangeRateHistory, ExchangeRateHistoryAdmin)
 admin.site.register(Portfolio, PortfolioAdmin)
 admin.site.register(PortfolioItem)
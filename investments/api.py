@@ -0,0 +1,137 @@
+import hashlib
+from typing import Optional
+
+from django.shortcuts import get_object_or_404
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from .models import Portfolio, PortfolioItem, Security
+from .exchanger import Exchanger
+from .graph import GRAPH_DATA_CALCULATORS
+from .serializers import PortfolioSerializer, PortfolioItemSerializer, SecuritySerializer
+from .services import delete_portfolio, update_portfolio_graphs, schedule_portfolio_graphs_update
+from .utils import get_current_portfolio_items, refresh_portfolio_prices
+from .versions import bump_portfolio_version, get_portfolio_etag, get_cached_portfolio_data, is_etag_matched
+
+
+class ConditionalGetMixin:
+    # Answers 304 when the client already has the representation of the current portfolio version
+    def _get_not_modified_or_none(self, request: Request, etag: str) -> Optional[Response]:
+        if is_etag_matched(request, etag):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return None
+
+    def _get_conditional_response(self, request: Request, etag: str, get_response) -> Response:
+        response = self._get_not_modified_or_none(request, etag)
+        if response is None:
+            response = get_response()
+            response['ETag'] = etag
+        return response
+
+
+def _get_list_etag(request: Request, versions: list[tuple[int, int]]) -> str:
+    content = repr((request.get_full_path(), versions)).encode()
+    return f'"{hashlib.sha1(content).hexdigest()}"'
+
+
+class PortfolioViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    serializer_class = PortfolioSerializer
+
+    def get_queryset(self):
+        return Portfolio.objects.filter(investor=self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        etag = _get_list_etag(request, list(self.get_queryset().order_by('pk').values_list('pk', 'version')))
+        return self._get_conditional_response(request, etag, lambda: super(PortfolioViewSet, self).list(request))
+
+    # Outdated prices are refreshed first: a refreshed price bumps the version the ETag is made of
+    def retrieve(self, request, *args, **kwargs):
+        portfolio = self.get_object()
+        refresh_portfolio_prices(portfolio)
+        return self._get_conditional_response(request, get_portfolio_etag(portfolio),
+                                              lambda: Response(self.get_serializer(portfolio).data))
+
+    @action(detail=True)
+    def allocations(self, request, pk=None):
+        portfolio = self.get_object()
+        refresh_portfolio_prices(portfolio)
+        return self._get_conditional_response(request, get_portfolio_etag(portfolio),
+                                              lambda: Response(get_cached_portfolio_data(
+                                                  portfolio, 'allocations',
+                                                  lambda: get_portfolio_allocations(portfolio))))
+
+    def perform_create(self, serializer):
+        portfolio = serializer.save(investor=self.request.user)
+        update_portfolio_graphs(portfolio)
+
+    def perform_update(self, serializer):
+        bump_portfolio_version(serializer.save())
+
+    def perform_destroy(self, instance):
+        delete_portfolio(instance)
+
+
+class PortfolioItemViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
+    serializer_class = PortfolioItemSerializer
+
+    def get_portfolio(self) -> Portfolio:
+        if not hasattr(self, '_portfolio'):
+            self._portfolio = get_object_or_404(Portfolio, pk=self.kwargs['portfolio_pk'], investor=self.request.user)
+        return self._portfolio
+
+    def get_queryset(self):
+        return PortfolioItem.objects.filter(portfolio=self.get_portfolio()).select_related('security')
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['portfolio'] = self.get_portfolio()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        etag = _get_list_etag(request, [(self.get_portfolio().pk, self.get_portfolio().version)])
+        return self._get_conditional_response(request, etag, lambda: super(PortfolioItemViewSet, self).list(request))
+
+    def retrieve(self, request, *args, **kwargs):
+        etag = _get_list_etag(request, [(self.get_portfolio().pk, self.get_portfolio().version)])
+        return self._get_conditional_response(request, etag,
+                                              lambda: Response(self.get_serializer(self.get_object()).data))
+
+    def perform_create(self, serializer):
+        serializer.save(portfolio=self.get_portfolio())
+        self._portfolio_changed()
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self._portfolio_changed()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        self._portfolio_changed()
+
+    def _portfolio_changed(self):
+        bump_portfolio_version(self.get_portfolio())
+        schedule_portfolio_graphs_update(self.get_portfolio())
+
+
+class SecurityViewSet(viewsets.ReadOnlyModelViewSet):
+    serializer_class = SecuritySerializer
+
+    def get_queryset(self):
+        securities = Security.objects.all()
+        for field in ('ticker', 'figi', 'currency', 'sector'):
+            if field in self.request.query_params:
+                securities = securities.filter(**{field: self.request.query_params[field]})
+        return securities
+
+
+def get_portfolio_allocations(portfolio: Portfolio) -> dict[str, list[dict]]:
+    items = list(get_current_portfolio_items(portfolio))
+    exchanger = Exchanger()
+    allocations = {}
+    for dimension, calculator_class in GRAPH_DATA_CALCULATORS.items():
+        calculator = calculator_class(portfolio, items, exchanger)
+        allocations[dimension] = [{'label': label, 'cost_usd': round(float(cost), 2)}
+                                  for label, cost in zip(calculator.labels, calculator.costs)]
+    return allocations
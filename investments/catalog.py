@@ -0,0 +1,83 @@
+import threading
+import uuid
+from typing import Iterable, Optional
+
+from django.core.cache import cache
+
+from .models import Security
+
+CATALOG_VERSION_KEY = 'security_catalog_version'
+
+
+class SecurityRecord:
+    __slots__ = ('pk', 'ticker', 'figi', 'name', 'currency')
+
+    def __init__(self, pk: int, ticker: str, figi: str, name: str, currency: str):
+        self.pk = pk
+        self.ticker = ticker
+        self.figi = figi
+        self.name = name
+        self.currency = currency
+
+
+# Static data of all securities kept in process memory, prices are left in the database
+class SecurityCatalog:
+    def __init__(self, version: Optional[str] = None):
+        self._version = version
+        self._records: list[SecurityRecord] = []
+        self._by_pk: dict[int, SecurityRecord] = {}
+        self._by_ticker: dict[str, SecurityRecord] = {}
+        self._by_figi: dict[str, SecurityRecord] = {}
+        self._load()
+
+    def _load(self):
+        for row in Security.objects.order_by('ticker').values_list('pk', 'ticker', 'figi', 'name', 'currency'):
+            record = SecurityRecord(*row)
+            self._records.append(record)
+            self._by_pk[record.pk] = record
+            self._by_ticker[record.ticker] = record
+            self._by_figi[record.figi] = record
+
+    def get(self, pk: int) -> Optional[SecurityRecord]:
+        return self._by_pk.get(pk)
+
+    def find(self, key: str) -> Optional[SecurityRecord]:
+        return self._by_figi.get(key) or self._by_ticker.get(key)
+
+    def exclude(self, pks: Iterable[int]) -> list[SecurityRecord]:
+        pks = set(pks)
+        return [x for x in self._records if x.pk not in pks]
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._version
+
+    @property
+    def records(self) -> list[SecurityRecord]:
+        return self._records
+
+    @property
+    def tickers(self) -> list[str]:
+        return list(self._by_ticker)
+
+
+_catalog: Optional[SecurityCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+# Catalog is reloaded when any process bumps the version after securities are created, renamed or deleted.
+# Version is a random token, so a cleared cache also makes every process reload
+def get_security_catalog() -> SecurityCatalog:
+    global _catalog
+    version = cache.get_or_set(CATALOG_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+    catalog = _catalog
+    if catalog is None or catalog.version != version:
+        with _catalog_lock:
+            if _catalog is None or _catalog.version != version:
+                _catalog = SecurityCatalog(version)
+            catalog = _catalog
+    return catalog
+
+
+def bump_security_catalog_version():
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
@@ -0,0 +1,89 @@
+import time
+from typing import Any, Callable
+
+from django.core.cache import cache
+
+from config.settings import CIRCUIT_BREAKER_FAILURE_RATE, CIRCUIT_BREAKER_MIN_CALLS, CIRCUIT_BREAKER_WINDOW, \
+    CIRCUIT_BREAKER_OPEN_TIMEOUT
+from .exceptions import ProviderUnavailable
+
+
+# Circuit state is kept in the cache, so all workers stop calling a failing provider together.
+# Calls and failures are counted with atomic cache increments in fixed windows of window seconds.
+# Open circuit fails calls at once, after open_timeout one probe call decides whether it closes or stays open
+class CircuitBreaker:
+    def __init__(self, name: str, failure_rate: float = CIRCUIT_BREAKER_FAILURE_RATE,
+                 min_calls: int = CIRCUIT_BREAKER_MIN_CALLS, window: float = CIRCUIT_BREAKER_WINDOW,
+                 open_timeout: float = CIRCUIT_BREAKER_OPEN_TIMEOUT, ignore: tuple[type, ...] = ()):
+        self._name = name
+        self._failure_rate = failure_rate
+        self._min_calls = min_calls
+        self._window = window
+        self._open_timeout = open_timeout
+        # Exceptions that are valid provider answers and do not count as failures
+        self._ignore = ignore
+        self._opened_key = f'circuit:{name}:opened_at'
+        self._probe_key = f'circuit:{name}:probe'
+
+    def call(self, function: Callable[[], Any]) -> Any:
+        if not self._is_call_allowed():
+            raise ProviderUnavailable(f'{self._name} circuit is open')
+        try:
+            result = function()
+        except self._ignore:
+            self._record(success=True)
+            raise
+        except Exception as e:
+            self._record(success=False)
+            raise ProviderUnavailable(f'{self._name} call failed: {e!r}') from e
+        self._record(success=True)
+        return result
+
+    def reset(self):
+        cache.delete_many([self._opened_key, self._probe_key, *self._get_counter_keys()])
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def is_open(self) -> bool:
+        return cache.get(self._opened_key) is not None
+
+    def _is_call_allowed(self) -> bool:
+        opened_at = cache.get(self._opened_key)
+        if opened_at is None:
+            return True
+        if time.time() - opened_at < self._open_timeout:
+            return False
+        return cache.add(self._probe_key, True, self._open_timeout)
+
+    def _record(self, success: bool):
+        if cache.get(self._opened_key) is not None:
+            # Probe call result
+            if success:
+                cache.delete_many([self._opened_key, *self._get_counter_keys()])
+                print('$$ Circuit closed:', self._name)
+            else:
+                cache.set(self._opened_key, time.time(), None)
+            cache.delete(self._probe_key)
+            return
+        calls_key, failures_key = self._get_counter_keys()
+        calls = self._increment(calls_key)
+        failures = cache.get(failures_key, 0) if success else self._increment(failures_key)
+        if calls >= self._min_calls and failures / calls >= self._failure_rate:
+            if cache.add(self._opened_key, time.time(), None):
+                print('$$ Circuit opened:', self._name)
+
+    def _get_counter_keys(self) -> tuple[str, str]:
+        window = int(time.time() // self._window)
+        return f'circuit:{self._name}:{window}:calls', f'circuit:{self._name}:{window}:failures'
+
+    def _increment(self, key: str) -> int:
+        cache.add(key, 0, self._window * 2)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Counter expired between add and incr
+            cache.add(key, 1, self._window * 2)
+            return 1
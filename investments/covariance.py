@@ -0,0 +1,112 @@
+import time
+import datetime
+from typing import Optional
+
+import numpy as np
+from django.core.cache import cache
+
+from .models import Portfolio, Security
+from .exchanger import ExchangeRateHistoryIndex
+from .performance import fill_forward
+from .price_history import get_usd_price_matrix, get_returns
+from .utils import get_today
+
+COVARIANCE_WINDOW = 250  # trading days
+COVARIANCE_CACHE_KEY = 'return_covariance'
+COVARIANCE_VERSION_CACHE_KEY = 'return_covariance_version'
+
+
+class RollingCovariance:
+    # Keeps sums and cross products of the last window returns, so adding k days costs O(k * n^2)
+    def __init__(self, figis: list[str], window: int = COVARIANCE_WINDOW):
+        self.figis = figis
+        self.window = window
+        self.last_date: Optional[datetime.date] = None
+        self.last_prices = np.zeros(len(figis))
+        self._returns = np.zeros((0, len(figis)))
+        self._sums = np.zeros(len(figis))
+        self._cross = np.zeros((len(figis), len(figis)))
+
+    def append(self, returns: np.ndarray):
+        if not len(returns):
+            return
+        self._sums += returns.sum(axis=0)
+        self._cross += returns.T @ returns
+        self._returns = np.vstack([self._returns, returns])
+        if len(self._returns) > self.window:
+            dropped = self._returns[:-self.window]
+            self._sums -= dropped.sum(axis=0)
+            self._cross -= dropped.T @ dropped
+            self._returns = self._returns[-self.window:]
+
+    @property
+    def count(self) -> int:
+        return len(self._returns)
+
+    def get_covariance(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        indices = np.arange(len(self.figis)) if indices is None else indices
+        if self.count < 2:
+            return np.full((len(indices), len(indices)), np.nan)
+        sums = self._sums[indices]
+        return (self._cross[np.ix_(indices, indices)] - np.outer(sums, sums) / self.count) / (self.count - 1)
+
+    def get_correlation(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        covariance = self.get_covariance(indices)
+        deviations = np.sqrt(np.clip(np.diag(covariance), 0, None))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlation = covariance / np.outer(deviations, deviations)
+        correlation = np.nan_to_num(np.clip(correlation, -1, 1), nan=0.0)
+        np.fill_diagonal(correlation, 1.0)
+        return correlation
+
+
+class ReturnCovarianceService:
+    # The statistics live in the shared cache; every process keeps the last loaded copy until the version changes
+    _loaded_version = None
+    _loaded_covariance: Optional[RollingCovariance] = None
+
+    def update(self, rebuild: bool = False) -> RollingCovariance:
+        securities = list(Security.objects.filter(portfolioitem__isnull=False).distinct().order_by('pk'))
+        covariance = None if rebuild else self.get_covariance()
+        if covariance is None or covariance.figis != [x.figi for x in securities]:
+            covariance = RollingCovariance([x.figi for x in securities])
+            date_from = get_today() - datetime.timedelta(days=int(covariance.window * 1.6))
+        else:
+            date_from = covariance.last_date + datetime.timedelta(days=1)
+        self._append_prices(covariance, securities, date_from)
+        self._save(covariance)
+        return covariance
+
+    def _append_prices(self, covariance: RollingCovariance, securities: list[Security], date_from: datetime.date):
+        dates, prices = get_usd_price_matrix(securities, date_from, get_today(), ExchangeRateHistoryIndex())
+        if not len(dates):
+            return
+        if covariance.last_date is not None:
+            prices = np.vstack([covariance.last_prices, prices])
+        covariance.append(get_returns(prices))
+        covariance.last_date = dates[-1].tolist()
+        covariance.last_prices = fill_forward(prices.T).T[-1]
+
+    def _save(self, covariance: RollingCovariance):
+        version = time.time_ns()
+        cache.set(COVARIANCE_CACHE_KEY, covariance, None)
+        cache.set(COVARIANCE_VERSION_CACHE_KEY, version, None)
+        ReturnCovarianceService._loaded_version = version
+        ReturnCovarianceService._loaded_covariance = covariance
+
+    def get_covariance(self) -> Optional[RollingCovariance]:
+        version = cache.get(COVARIANCE_VERSION_CACHE_KEY)
+        if version != ReturnCovarianceService._loaded_version:
+            ReturnCovarianceService._loaded_covariance = cache.get(COVARIANCE_CACHE_KEY)
+            ReturnCovarianceService._loaded_version = version
+        return ReturnCovarianceService._loaded_covariance
+
+    def get_portfolio_matrices(self, portfolio: Portfolio) -> Optional[tuple[list[str], np.ndarray, np.ndarray]]:
+        covariance = self.get_covariance()
+        if covariance is None:
+            return None
+        index = {figi: i for i, figi in enumerate(covariance.figis)}
+        held = portfolio.portfolioitem_set.values_list('security__figi', flat=True)
+        figis = [x for x in held if x in index]
+        indices = np.array([index[x] for x in figis], dtype=np.int64)
+        return figis, covariance.get_covariance(indices), covariance.get_correlation(indices)
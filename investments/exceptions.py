@@ -1,3 +1,11 @@
 
 class StockNotFound(Exception):
     pass
+
+
+class ExchangeRateNotFound(Exception):
+    pass
+
+
+class ProviderUnavailable(Exception):
+    pass
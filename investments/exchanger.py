@@ -1,9 +1,20 @@
+import datetime
 import requests
+from bisect import bisect_right
+from typing import Iterable, Optional
 from decimal import Decimal, ROUND_HALF_UP
 
-from config.settings import EXCHANGE_API_KEY
-from .models import ExchangeRate
+import numpy as np
+
+from config.settings import EXCHANGE_API_KEY, PROVIDER_TIMEOUT
+from .models import ExchangeRate, ExchangeRateHistory
+from .exceptions import ExchangeRateNotFound, ProviderUnavailable
+from .circuit_breaker import CircuitBreaker
 from .utils import get_today
+from .versions import bump_all_portfolios_versions, mark_portfolio_data_stale
+
+HISTORY_CURRENCIES = ('EUR', 'RUB')
+exchange_rate_circuit = CircuitBreaker('exchangerate-api')
 
 
 class Exchanger:
@@ -11,12 +22,20 @@ class Exchanger:
         self._rates_data = None
         self._exr_obj = None
         self._today = get_today()
+        self._is_stale = False
         self._update_rates()
 
     def _update_rates(self):
         self._try_get_exchange_rate()
         if self._is_exchange_rate_object_expired():
-            self._request_conversion_rates_data()
+            try:
+                self._request_conversion_rates_data()
+            except ProviderUnavailable as e:
+                # Last known rates are served until the provider is back
+                self._is_stale = True
+                mark_portfolio_data_stale()
+                print('$$ Exchange rate is stale:', e)
+                return
             self._update_exchange_rate_object()
 
     def _try_get_exchange_rate(self):
@@ -32,6 +51,8 @@ class Exchanger:
         self._exr_obj.eur_rate = self._rates_data['EUR']
         self._exr_obj.rub_rate = self._rates_data['RUB']
         self._exr_obj.save()
+        self._append_exchange_rate_history()
+        bump_all_portfolios_versions()
         print('$$ Exchange rate is expired. Getting update.')
 
     def _get_exchange_rate_object(self):
@@ -44,13 +65,23 @@ class Exchanger:
 
     def _request_conversion_rates_data(self):
         url = f'https://v6.exchangerate-api.com/v6/{EXCHANGE_API_KEY}/latest/USD'
-        response = requests.get(url)
-        self._rates_data = response.json()['conversion_rates']
+        self._rates_data = exchange_rate_circuit.call(
+            lambda: requests.get(url, timeout=PROVIDER_TIMEOUT).json()['conversion_rates'])
 
     def _create_exchange_rate(self):
         self._exr_obj = ExchangeRate(pk=1, last_updated=self._today, eur_rate=self._rates_data['EUR'],
                                      rub_rate=self._rates_data['RUB'])
         self._exr_obj.save()
+        self._append_exchange_rate_history()
+
+    def _append_exchange_rate_history(self):
+        rows = [ExchangeRateHistory(date=self._today, currency=currency, rate=self._rates_data[currency])
+                for currency in HISTORY_CURRENCIES]
+        ExchangeRateHistory.objects.bulk_create(rows, ignore_conflicts=True)
+
+    @property
+    def is_stale(self) -> bool:
+        return self._is_stale
 
     @property
     def eur_rate(self) -> Decimal:
@@ -59,3 +90,49 @@ class Exchanger:
     @property
     def rub_rate(self) -> Decimal:
         return Decimal(self._exr_obj.rub_rate).quantize(Decimal('1.01'), rounding=ROUND_HALF_UP)
+
+
+# Rate of a currency on a date is the last known rate on or before that date
+class ExchangeRateHistoryIndex:
+    def __init__(self, currencies: Optional[Iterable[str]] = None):
+        self._ordinals: dict[str, list[int]] = {}
+        self._ordinals_array: dict[str, np.ndarray] = {}
+        self._rates: dict[str, np.ndarray] = {}
+        self._load(currencies)
+
+    def _load(self, currencies: Optional[Iterable[str]]):
+        history = ExchangeRateHistory.objects.order_by('currency', 'date')
+        if currencies is not None:
+            history = history.filter(currency__in=list(currencies))
+        grouped: dict[str, tuple[list[int], list[float]]] = {}
+        for currency, date, rate in history.values_list('currency', 'date', 'rate').iterator():
+            ordinals, rates = grouped.setdefault(currency, ([], []))
+            ordinals.append(date.toordinal())
+            rates.append(float(rate))
+        for currency, (ordinals, rates) in grouped.items():
+            self._ordinals[currency] = ordinals
+            self._ordinals_array[currency] = np.array(ordinals, dtype=np.int64)
+            self._rates[currency] = np.array(rates, dtype=np.float64)
+
+    def get_rate(self, currency: str, date: datetime.date) -> Decimal:
+        if currency == 'USD':
+            return Decimal(1)
+        ordinals = self._ordinals.get(currency)
+        i = bisect_right(ordinals, date.toordinal()) - 1 if ordinals else -1
+        if i < 0:
+            raise ExchangeRateNotFound(f'Exchange rate for {currency} on {date} is not found')
+        return Decimal(str(self._rates[currency][i])).quantize(Decimal('1.0001'), rounding=ROUND_HALF_UP)
+
+    def get_rates(self, currency: str, dates: Iterable[datetime.date]) -> np.ndarray:
+        ordinals = np.fromiter((x.toordinal() for x in dates), dtype=np.int64)
+        if currency == 'USD':
+            return np.ones(len(ordinals), dtype=np.float64)
+        if currency not in self._rates:
+            return np.full(len(ordinals), np.nan)
+        positions = np.searchsorted(self._ordinals_array[currency], ordinals, side='right') - 1
+        rates = self._rates[currency][np.clip(positions, 0, None)]
+        rates[positions < 0] = np.nan
+        return rates
+
+    def convert_to_usd(self, currency: str, dates: Iterable[datetime.date], amounts: Iterable[float]) -> np.ndarray:
+        return np.asarray(amounts, dtype=np.float64) / self.get_rates(currency, dates)
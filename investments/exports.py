@@ -0,0 +1,107 @@
+import csv
+import json
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable, Iterator
+
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
+
+from .models import Portfolio, PortfolioItem, PortfolioSnapshot
+from .exchanger import Exchanger
+from .graph import GRAPH_DATA_CALCULATORS
+
+EXPORT_CHUNK_SIZE = 2000
+
+HOLDINGS_COLUMNS = ('portfolio', 'ticker', 'figi', 'name', 'currency', 'quantity', 'price', 'cost', 'cost_usd')
+VALUATIONS_COLUMNS = ('portfolio', 'date', 'total_value_usd', 'net_flow_usd')
+ALLOCATIONS_COLUMNS = ('portfolio', 'dimension', 'label', 'cost_usd', 'share')
+
+
+class Echo:
+    # csv.writer writes into it and gets the line back instead of buffering the whole file
+    def write(self, value: str) -> str:
+        return value
+
+
+def iterate_holdings(portfolios: QuerySet) -> Iterator[tuple]:
+    items = _get_items(portfolios)
+    exchanger = Exchanger()
+    rates = {'USD': Decimal(1), 'EUR': exchanger.eur_rate, 'RUB': exchanger.rub_rate}
+    for item in items:
+        security = item.security
+        cost = security.price * item.quantity
+        yield (item.portfolio.name, security.ticker, security.figi, security.name, security.currency, item.quantity,
+               security.price, _round(cost), _round(cost / rates[security.currency]))
+
+
+def iterate_valuations(portfolios: QuerySet) -> Iterator[tuple]:
+    snapshots = PortfolioSnapshot.objects.filter(portfolio__in=portfolios).order_by('portfolio', 'date') \
+        .values_list('portfolio__name', 'date', 'total_value', 'net_flow')
+    yield from snapshots.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def iterate_allocations(portfolios: QuerySet) -> Iterator[tuple]:
+    # Items come ordered by portfolio, so only one portfolio is kept in memory at once
+    exchanger = Exchanger()
+    portfolio = None
+    items = []
+    for item in _get_items(portfolios):
+        if portfolio is not None and item.portfolio_id != portfolio.pk:
+            yield from _get_portfolio_allocations(portfolio, items, exchanger)
+            items = []
+        portfolio = item.portfolio
+        items.append(item)
+    if portfolio is not None:
+        yield from _get_portfolio_allocations(portfolio, items, exchanger)
+
+
+def _get_portfolio_allocations(portfolio: Portfolio, items: list[PortfolioItem], exchanger: Exchanger) \
+        -> Iterator[tuple]:
+    for dimension, calculator_class in GRAPH_DATA_CALCULATORS.items():
+        calculator = calculator_class(portfolio, items, exchanger)
+        total = sum(calculator.costs, Decimal(0))
+        for label, cost in zip(calculator.labels, calculator.costs):
+            share = (cost / total).quantize(Decimal('1.0001'), rounding=ROUND_HALF_UP) if total else Decimal(0)
+            yield portfolio.name, dimension, label, _round(cost), share
+
+
+def _get_items(portfolios: QuerySet) -> Iterator[PortfolioItem]:
+    items = PortfolioItem.objects.filter(portfolio__in=portfolios).select_related('portfolio', 'security') \
+        .order_by('portfolio', 'pk')
+    return items.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _round(value: Decimal) -> Decimal:
+    return Decimal(value).quantize(Decimal('1.01'), rounding=ROUND_HALF_UP)
+
+
+def stream_csv(columns: tuple[str, ...], rows: Iterable[tuple]) -> Iterator[str]:
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def stream_json(columns: tuple[str, ...], rows: Iterable[tuple]) -> Iterator[str]:
+    yield '['
+    for i, row in enumerate(rows):
+        yield (',' if i else '') + json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False)
+    yield ']'
+
+
+EXPORTS = {
+    'holdings': (HOLDINGS_COLUMNS, iterate_holdings),
+    'valuations': (VALUATIONS_COLUMNS, iterate_valuations),
+    'allocations': (ALLOCATIONS_COLUMNS, iterate_allocations)
+}
+
+
+def get_export_response(kind: str, portfolios: QuerySet, export_format: str) -> StreamingHttpResponse:
+    columns, iterate = EXPORTS[kind]
+    if export_format == 'json':
+        response = StreamingHttpResponse(stream_json(columns, iterate(portfolios)), content_type='application/json')
+    else:
+        export_format = 'csv'
+        response = StreamingHttpResponse(stream_csv(columns, iterate(portfolios)), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{kind}.{export_format}"'
+    return response
@@ -1,15 +1,18 @@
 from django import forms
 from django_select2.forms import Select2Widget
-from .models import PortfolioItem, Portfolio, Security
+from .models import PortfolioItem, Portfolio, Security, TargetAllocation
+from .catalog import get_security_catalog
 
 
 class PortfolioItemsCreateForm(forms.ModelForm):
-    security_select = forms.ModelChoiceField(queryset=Security.objects.all(), empty_label='Choose security')
+    # Choices come from the in-process security catalog, the field gives security pk
+    security_select = forms.TypedChoiceField(coerce=int, choices=())
 
     def __init__(self, portfolio: Portfolio, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        exclusion_list = [x.security.pk for x in PortfolioItem.objects.filter(portfolio=portfolio)]
-        self.fields['security_select'].queryset = Security.objects.all().exclude(pk__in=exclusion_list)
+        exclusion_list = PortfolioItem.objects.filter(portfolio=portfolio).values_list('security_id', flat=True)
+        self.fields['security_select'].choices = [('', 'Choose security')] + \
+            [(x.pk, x.name) for x in get_security_catalog().exclude(exclusion_list)]
 
     class Meta:
         model = PortfolioItem
@@ -43,6 +46,45 @@ class PortfolioItemsIncreaseQuantityForm(forms.ModelForm):
         fields = ['field', 'quantity']
 
 
+class TargetAllocationCreateForm(forms.ModelForm):
+    class Meta:
+        model = TargetAllocation
+        fields = ['dimension', 'label', 'weight']
+
+
+class TargetAllocationDeleteForm(forms.Form):
+    target = forms.ModelChoiceField(queryset=TargetAllocation.objects.all(), empty_label='Choose target')
+
+    def __init__(self, portfolio: Portfolio, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['target'].queryset = TargetAllocation.objects.filter(portfolio=portfolio)
+
+
+class RebalanceForm(forms.Form):
+    dimension = forms.ChoiceField(choices=TargetAllocation.dimension_choice)
+    cash = forms.DecimalField(label='Cash, USD', min_value=0, max_digits=16, decimal_places=2, initial=0)
+    allow_sells = forms.BooleanField(label='Allow sells', required=False, initial=True)
+
+
+class PortfolioItemBatchForm(forms.Form):
+    action_choice = (
+        ('create', 'Add security'),
+        ('increase', 'Increase quantity'),
+        ('delete', 'Delete security')
+    )
+
+    action = forms.ChoiceField(choices=action_choice, initial='create')
+    ticker = forms.CharField(label='Ticker or FIGI', max_length=16)
+    quantity = forms.IntegerField(required=False)
+
+
+PortfolioItemBatchFormSet = forms.formset_factory(PortfolioItemBatchForm, extra=10)
+
+
+class PortfolioItemsImportForm(forms.Form):
+    file = forms.FileField(label='CSV file with ticker or FIGI and quantity columns')
+
+
 class PortfolioCreateForm(forms.ModelForm):
     class Meta:
         model = Portfolio
@@ -0,0 +1,73 @@
+import datetime
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from django.utils import timezone
+
+from config.settings import PRICE_INTRADAY_TTL, MARKET_HOLIDAYS
+from .models import Security
+
+
+class TradingCalendar:
+    def __init__(self, name: str, time_zone: str, opens: datetime.time, closes: datetime.time):
+        self._name = name
+        self._zone = ZoneInfo(time_zone)
+        self._opens = opens
+        self._closes = closes
+        self._holidays = {datetime.date.fromisoformat(x) for x in MARKET_HOLIDAYS.get(name, ())}
+
+    def is_trading_day(self, date: datetime.date) -> bool:
+        return date.weekday() < 5 and date not in self._holidays
+
+    def is_open(self, moment: datetime.datetime) -> bool:
+        local = moment.astimezone(self._zone)
+        return self.is_trading_day(local.date()) and self._opens <= local.time() < self._closes
+
+    def get_last_close(self, moment: datetime.datetime) -> datetime.datetime:
+        local = moment.astimezone(self._zone)
+        date = local.date() if local.time() >= self._closes else local.date() - datetime.timedelta(days=1)
+        while not self.is_trading_day(date):
+            date -= datetime.timedelta(days=1)
+        return datetime.datetime.combine(date, self._closes, tzinfo=self._zone)
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+
+# Securities are traded on the main exchange of their currency
+CALENDARS = {
+    'USD': TradingCalendar('NYSE', 'America/New_York', datetime.time(9, 30), datetime.time(16)),
+    'RUB': TradingCalendar('MOEX', 'Europe/Moscow', datetime.time(10), datetime.time(18, 50)),
+    'EUR': TradingCalendar('XETRA', 'Europe/Berlin', datetime.time(9), datetime.time(17, 30))
+}
+
+
+def get_security_type(security: Security) -> str:
+    if security.sector == 'BOND':
+        return 'bond'
+    if security.sector == 'ETF':
+        return 'etf'
+    return 'stock'
+
+
+# Price can not move while its exchange is closed: it is fresh if it was got after the last close.
+# During trading hours it is fresh for the intraday TTL of its security type
+def is_price_fresh(security: Security, now: Optional[datetime.datetime] = None) -> bool:
+    now = now or timezone.now()
+    updated_at = get_price_updated_at(security)
+    if updated_at is None:
+        return False
+    calendar = CALENDARS[security.currency]
+    if calendar.is_open(now):
+        return now - updated_at < datetime.timedelta(seconds=PRICE_INTRADAY_TTL[get_security_type(security)])
+    return updated_at >= calendar.get_last_close(now)
+
+
+# Prices saved before price_updated_at was added are known only by date, counted from its start
+def get_price_updated_at(security: Security) -> Optional[datetime.datetime]:
+    if security.price_updated_at is not None:
+        return security.price_updated_at
+    if security.last_updated is None:
+        return None
+    return datetime.datetime.combine(security.last_updated, datetime.time(), tzinfo=datetime.timezone.utc)
@@ -1,9 +1,10 @@
-import os
-import matplotlib.pyplot as plt
+from typing import Iterable, Optional
+from django.utils.module_loading import import_string
 
-from config.settings import MEDIA_ROOT
-from .models import Portfolio
+from config.settings import GRAPH_MAX_SLICES, GRAPH_MIN_SLICE_SHARE, GRAPH_RENDERER, GRAPH_COMPOSITE
+from .models import Portfolio, PortfolioItem
 from .exchanger import Exchanger
+from .graph_storage import save_graph_content
 from .utils import get_current_portfolio_items
 
 
@@ -12,34 +13,39 @@ class AbstractGraphDrawer:
     def __init__(self, portfolio: Portfolio):
         self._portfolio = portfolio
         self._graph_name = None
-        self._graph_path = None
-        self._fig = None
-        self._axe = None
+        self._graph_file_name = None
+        self._renderer = get_graph_renderer_class()()
         self._cost = None
         self._labels = None
         self._calculator: AbstractGraphDataCalculator(portfolio) = None
 
     def update_graph(self):
-        self._set_graph_path()
+        self.draw_graph()
+        self.save_graph()
+
+    def draw_graph(self):
         self._update_graph_data()
         self._draw_graph()
+
+    def save_graph(self):
         self._save_graph()
+        self.close_graph()
 
-    def _set_graph_path(self):
-        self._graph_path = GraphPath(self._portfolio.pk, self._graph_name)
+    def close_graph(self):
+        self._renderer.close()
 
     def _update_graph_data(self):
-        self._cost = self._calculator.costs
-        self._labels = self._calculator.labels
+        self._labels, self._cost = self._calculator.get_bucketed_data(GRAPH_MAX_SLICES, GRAPH_MIN_SLICE_SHARE)
 
     def _draw_graph(self):
-        plt.switch_backend('AGG')
-        self._fig, self._axe = plt.subplots()
-        self._axe.pie(self._cost, labels=self._labels, autopct='%1.1f%%')
+        self._renderer.draw(self._labels, self._cost)
 
     def _save_graph(self):
-        os.makedirs(self._graph_path.graph_full_root, exist_ok=True)
-        self._fig.savefig(self._graph_path.graph_full_path)
+        self._graph_file_name = save_graph_content(self._renderer.get_content(), self._renderer.extension)
+
+    @property
+    def graph_file_name(self) -> Optional[str]:
+        return self._graph_file_name
 
 
 class SecurityGraphDrawer(AbstractGraphDrawer):
@@ -77,12 +83,44 @@ class CurrencyGraphDrawer(AbstractGraphDrawer):
         self._calculator = CurrencyGraphDataCalculator(portfolio)
 
 
-class AbstractGraphDataCalculator:
+# All breakdowns as subplots of one graph: items and exchange rates are loaded once, one file is saved
+class CompositeGraphDrawer(AbstractGraphDrawer):
+    titles = {'security': 'Securities', 'sector': 'Sectors', 'country': 'Countries', 'market': 'Markets',
+              'currency': 'Currencies'}
+
     def __init__(self, portfolio: Portfolio):
-        self._exchanger: Exchanger() = None
-        self._items = get_current_portfolio_items(portfolio)
+        super().__init__(portfolio)
+        self._graph_name = 'allocation'
+        items = list(get_current_portfolio_items(portfolio))
+        exchanger = Exchanger()
+        self._calculators = {dimension: calculator_class(portfolio, items, exchanger)
+                             for dimension, calculator_class in GRAPH_DATA_CALCULATORS.items()}
+        self._charts = None
+
+    def _update_graph_data(self):
+        self._charts = [(self.titles[dimension], *calculator.get_bucketed_data(GRAPH_MAX_SLICES, GRAPH_MIN_SLICE_SHARE))
+                        for dimension, calculator in self._calculators.items()]
+
+    def _draw_graph(self):
+        self._renderer.draw_composite(self._charts)
+
+
+def get_portfolio_graph_drawers(portfolio: Portfolio) -> list[AbstractGraphDrawer]:
+    if GRAPH_COMPOSITE:
+        return [CompositeGraphDrawer(portfolio)]
+    return [SecurityGraphDrawer(portfolio), SectorGraphDrawer(portfolio), CountryGraphDrawer(portfolio),
+            MarketGraphDrawer(portfolio), CurrencyGraphDrawer(portfolio)]
+
+
+class AbstractGraphDataCalculator:
+    def __init__(self, portfolio: Portfolio, items: Optional[Iterable[PortfolioItem]] = None,
+                 exchanger: Optional[Exchanger] = None):
+        self._exchanger: Exchanger() = exchanger
+        self._items = get_current_portfolio_items(portfolio) if items is None else items
         self._costs = []
         self._labels = []
+        self._item_costs = []
+        self._item_labels = []
         self._item = None
         self._currency_divider = None
         self._cost = None
@@ -107,6 +145,10 @@ class AbstractGraphDataCalculator:
     def _calculate_cost(self):
         self._cost = (self._item.security.price / self._currency_divider) * self._item.quantity
 
+    def _remember_item(self, label: str):
+        self._item_costs.append(self._cost)
+        self._item_labels.append(label)
+
     def _increase_existing_item(self, label: str):
         i = self._labels.index(label)
         self._costs[i] += self._cost
@@ -117,11 +159,15 @@ class AbstractGraphDataCalculator:
 
     def _increase_label_cost_if_in_labels_or_append_new(self, label: str):
         self._calculate_cost()
+        self._remember_item(label)
         if label in self._labels:
             self._increase_existing_item(label)
         else:
             self._append_new_item(label)
 
+    def get_bucketed_data(self, max_slices: int, min_share: float) -> tuple[list[str], list]:
+        return bucket_graph_data(self._labels, self._costs, max_slices, min_share)
+
     @property
     def costs(self):
         return self._costs
@@ -130,22 +176,33 @@ class AbstractGraphDataCalculator:
     def labels(self):
         return self._labels
 
+    @property
+    def item_costs(self):
+        return self._item_costs
+
+    @property
+    def item_labels(self):
+        return self._item_labels
+
 
 class SecurityGraphDataCalculator(AbstractGraphDataCalculator):
-    def __init__(self, portfolio: Portfolio):
-        super().__init__(portfolio)
-        self._exchanger = Exchanger()
+    def __init__(self, portfolio: Portfolio, items: Optional[Iterable[PortfolioItem]] = None,
+                 exchanger: Optional[Exchanger] = None):
+        super().__init__(portfolio, items, exchanger)
+        self._exchanger = self._exchanger or Exchanger()
         self._update_graph_data()
 
     def _process_item(self):
         self._calculate_cost()
+        self._remember_item(self._item.security.ticker)
         self._append_new_item(self._item.security.ticker)
 
 
 class SectorGraphDataCalculator(AbstractGraphDataCalculator):
-    def __init__(self, portfolio: Portfolio):
-        super().__init__(portfolio)
-        self._exchanger = Exchanger()
+    def __init__(self, portfolio: Portfolio, items: Optional[Iterable[PortfolioItem]] = None,
+                 exchanger: Optional[Exchanger] = None):
+        super().__init__(portfolio, items, exchanger)
+        self._exchanger = self._exchanger or Exchanger()
         self._update_graph_data()
 
     def _process_item(self):
@@ -157,9 +214,10 @@ class SectorGraphDataCalculator(AbstractGraphDataCalculator):
 
 
 class CountryGraphDataCalculator(AbstractGraphDataCalculator):
-    def __init__(self, portfolio: Portfolio):
-        super().__init__(portfolio)
-        self._exchanger = Exchanger()
+    def __init__(self, portfolio: Portfolio, items: Optional[Iterable[PortfolioItem]] = None,
+                 exchanger: Optional[Exchanger] = None):
+        super().__init__(portfolio, items, exchanger)
+        self._exchanger = self._exchanger or Exchanger()
         self._update_graph_data()
 
     def _process_item(self):
@@ -171,9 +229,10 @@ class CountryGraphDataCalculator(AbstractGraphDataCalculator):
 
 
 class MarketGraphDataCalculator(AbstractGraphDataCalculator):
-    def __init__(self, portfolio: Portfolio):
-        super().__init__(portfolio)
-        self._exchanger = Exchanger()
+    def __init__(self, portfolio: Portfolio, items: Optional[Iterable[PortfolioItem]] = None,
+                 exchanger: Optional[Exchanger] = None):
+        super().__init__(portfolio, items, exchanger)
+        self._exchanger = self._exchanger or Exchanger()
         self._update_graph_data()
 
     def _process_item(self):
@@ -201,40 +260,36 @@ class MarketGraphDataCalculator(AbstractGraphDataCalculator):
 
 
 class CurrencyGraphDataCalculator(AbstractGraphDataCalculator):
-    def __init__(self, portfolio: Portfolio):
-        super().__init__(portfolio)
-        self._exchanger = Exchanger()
+    def __init__(self, portfolio: Portfolio, items: Optional[Iterable[PortfolioItem]] = None,
+                 exchanger: Optional[Exchanger] = None):
+        super().__init__(portfolio, items, exchanger)
+        self._exchanger = self._exchanger or Exchanger()
         self._update_graph_data()
 
     def _process_item(self):
         self._increase_label_cost_if_in_labels_or_append_new(self._item.security.currency)
 
 
-class GraphPath:
-    def __init__(self, pk: int, graph_type: str):
-        self._pk = pk
-        self._graph_type = graph_type
-        self._graph_name = None
-        self._graph_path = None
-        self._graph_full_root = None
-        self._graph_full_path = None
-        self._define_name_and_paths()
-
-    def _define_name_and_paths(self):
-        self._graph_name = os.path.join(f'{self._graph_type}_pie.png')
-        portfolio_graph_root = os.path.join('portfolio_graph', f'{self._pk}')
-        self._graph_path = os.path.join(portfolio_graph_root, self._graph_name)
-        self._graph_full_root = os.path.join(MEDIA_ROOT, portfolio_graph_root)
-        self._graph_full_path = os.path.join(self._graph_full_root, self._graph_name)
+GRAPH_DATA_CALCULATORS = {
+    'security': SecurityGraphDataCalculator,
+    'sector': SectorGraphDataCalculator,
+    'country': CountryGraphDataCalculator,
+    'market': MarketGraphDataCalculator,
+    'currency': CurrencyGraphDataCalculator
+}
 
-    @property
-    def graph_path(self):
-        return self._graph_path
 
-    @property
-    def graph_full_root(self):
-        return self._graph_full_root
+# Largest slices are kept, the tail and slices smaller than min_share are folded into one 'Other' slice
+def bucket_graph_data(labels: list[str], costs: list, max_slices: int, min_share: float) -> tuple[list[str], list]:
+    total = sum(costs)
+    if not total or (len(costs) <= max_slices and all(cost / total >= min_share for cost in costs)):
+        return list(labels), list(costs)
+    order = sorted(range(len(costs)), key=lambda i: costs[i], reverse=True)
+    kept = [i for i in order[:max_slices - 1] if costs[i] / total >= min_share]
+    other = sum(costs[i] for i in order[len(kept):])
+    return [labels[i] for i in kept] + ['Other'], [costs[i] for i in kept] + [other]
 
-    @property
-    def graph_full_path(self):
-        return self._graph_full_path
+
+# Renderer is chosen per deployment, matplotlib is imported only by its own renderer
+def get_graph_renderer_class():
+    return import_string(GRAPH_RENDERER)
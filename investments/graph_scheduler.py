@@ -0,0 +1,95 @@
+import threading
+import time
+from typing import Callable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from .models import Portfolio
+
+
+class GraphRegenerationScheduler:
+    # Edits of one portfolio within the delay are coalesced into one render. Every schedule increments
+    # the portfolio generation in the shared cache, so a render started for an older generation is dropped
+    # even if the newer edit came to another worker. Delayed renders are also recorded as pending in the cache:
+    # if the worker holding the timer is gone, render_if_pending renders the portfolio on its next page view.
+    def __init__(self, render: Callable[[Portfolio, Callable[[], bool]], None]):
+        self._render = render
+        self._lock = threading.Lock()
+        self._timers: dict[int, threading.Timer] = {}
+
+    @property
+    def _delay(self) -> float:
+        return getattr(settings, 'GRAPH_REGENERATION_DELAY', 0)
+
+    def schedule(self, portfolio: Portfolio):
+        generation = self._next_generation(portfolio.pk)
+        if self._delay <= 0:
+            self._render(portfolio, lambda: self._is_current(portfolio.pk, generation))
+            return
+        self._set_pending(portfolio.pk, generation)
+        timer = threading.Timer(self._delay, self._render_in_background, (portfolio.pk, generation))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.get(portfolio.pk)
+            if previous is not None:
+                previous.cancel()
+            self._timers[portfolio.pk] = timer
+        timer.start()
+
+    def render_if_pending(self, portfolio: Portfolio):
+        pending = cache.get(_get_pending_key(portfolio.pk))
+        if pending is None:
+            return
+        generation, pending_since = pending
+        if time.time() - pending_since <= self._delay:
+            return
+        # One worker takes over the lost render, the others keep serving current graphs
+        if not cache.add(_get_claim_key(portfolio.pk, generation), True, max(self._delay, 1)):
+            return
+        self._render_pending(portfolio, generation)
+
+    def _render_in_background(self, portfolio_pk: int, generation: int):
+        with self._lock:
+            if self._timers.get(portfolio_pk) is threading.current_thread():
+                del self._timers[portfolio_pk]
+        try:
+            portfolio = Portfolio.objects.filter(pk=portfolio_pk).first()
+            if portfolio is not None:
+                self._render_pending(portfolio, generation)
+        finally:
+            connection.close()
+
+    def _render_pending(self, portfolio: Portfolio, generation: int):
+        if not self._is_current(portfolio.pk, generation):
+            return
+        # Render in progress is not taken as lost by other workers for another delay
+        self._set_pending(portfolio.pk, generation)
+        self._render(portfolio, lambda: self._is_current(portfolio.pk, generation))
+        pending = cache.get(_get_pending_key(portfolio.pk))
+        if pending is not None and pending[0] == generation:
+            cache.delete(_get_pending_key(portfolio.pk))
+
+    def _set_pending(self, portfolio_pk: int, generation: int):
+        cache.set(_get_pending_key(portfolio_pk), (generation, time.time()), None)
+
+    def _next_generation(self, portfolio_pk: int) -> int:
+        key = _get_generation_key(portfolio_pk)
+        cache.add(key, 0, None)
+        return cache.incr(key)
+
+    def _is_current(self, portfolio_pk: int, generation: int) -> bool:
+        return cache.get(_get_generation_key(portfolio_pk)) == generation
+
+
+def _get_generation_key(portfolio_pk: int) -> str:
+    return f'portfolio_graph_generation:{portfolio_pk}'
+
+
+def _get_pending_key(portfolio_pk: int) -> str:
+    return f'portfolio_graph_pending:{portfolio_pk}'
+
+
+def _get_claim_key(portfolio_pk: int, generation: int) -> str:
+    return f'portfolio_graph_pending_claim:{portfolio_pk}:{generation}'
@@ -0,0 +1,192 @@
+import datetime
+import hashlib
+import os
+import posixpath
+import re
+from typing import Iterator, Optional, Union
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.http.request import HttpRequest
+from django.urls import reverse
+from django.utils import timezone
+
+from config.settings import GRAPH_SENDFILE_HEADER, GRAPH_ACCEL_REDIRECT_ROOT, GRAPH_VARIANT_WIDTHS
+from .models import Portfolio
+from .graph_variants import render_graph_variants, get_variant_extensions
+from .versions import is_etag_matched
+
+GRAPHS_ROOT = 'graphs'
+LEGACY_GRAPHS_ROOT = 'portfolio_graph'
+GRAPH_FIELDS = ('securities_graph', 'sector_graph', 'country_graph', 'market_graph', 'currency_graph')
+GRAPH_GARBAGE_MIN_AGE = datetime.timedelta(hours=1)
+IMMUTABLE_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml', 'webp': 'image/webp', 'avif': 'image/avif'}
+RASTER_EXTENSIONS = ('png',)
+VARIANT_FILE_NAME = re.compile(r'^(?P<digest>[0-9a-f]{64})-\d+\.(webp|avif)$')
+
+
+# Graph files are named by hash of their content and sharded by its first bytes: graphs/ab/cd/abcd...ef.png
+# Portfolios with identical breakdowns share one file, so files are only removed by collect_graph_garbage
+def get_graph_name(content: bytes, extension: str) -> str:
+    digest = hashlib.sha256(content).hexdigest()
+    return posixpath.join(GRAPHS_ROOT, digest[:2], digest[2:4], f'{digest}.{extension}')
+
+
+def save_graph_content(content: bytes, extension: str) -> str:
+    name = get_graph_name(content, extension)
+    if not default_storage.exists(name):
+        if extension in RASTER_EXTENSIONS:
+            for width, variant_extension, variant_content in render_graph_variants(content):
+                _save_file(get_graph_variant_name(name, width, variant_extension), variant_content)
+        _save_file(name, content)
+    else:
+        # Variants missing for graphs saved before them or before a new variant format are made now
+        if any(not default_storage.exists(x) for x in _get_variant_names(name)):
+            for width, variant_extension, variant_content in render_graph_variants(content):
+                variant_name = get_graph_variant_name(name, width, variant_extension)
+                if not default_storage.exists(variant_name):
+                    _save_file(variant_name, variant_content)
+        # Reused file is about to be referenced again, a fresh modified time keeps it from garbage collection
+        for reused_name in [name, *_get_variant_names(name)]:
+            _touch_file(reused_name)
+    return name
+
+
+# Variants are named after the graph they are made from: graphs/ab/cd/abcd...ef-640.webp
+def get_graph_variant_name(name: str, width: int, extension: str) -> str:
+    return f'{posixpath.splitext(name)[0]}-{width}.{extension}'
+
+
+def _get_variant_names(name: str) -> list[str]:
+    if posixpath.splitext(name)[1][1:] not in RASTER_EXTENSIONS:
+        return []
+    return [get_graph_variant_name(name, width, extension)
+            for width in GRAPH_VARIANT_WIDTHS for extension in get_variant_extensions()]
+
+
+# Storages without local paths are covered by the reference check right before garbage is deleted
+def _touch_file(name: str):
+    try:
+        path = default_storage.path(name)
+    except NotImplementedError:
+        return
+    if os.path.exists(path):
+        os.utime(path)
+
+
+def _save_file(name: str, content: bytes):
+    saved_name = default_storage.save(name, ContentFile(content))
+    if saved_name != name:
+        # The same file was saved concurrently under the content name
+        default_storage.delete(saved_name)
+
+
+def get_graph_url(portfolio: Portfolio, name: Optional[str]) -> str:
+    return reverse('portfolio_graph', args=[portfolio.pk, posixpath.basename(name)]) if name else ''
+
+
+# Fallback url of a graph and srcset of its compressed variants for each of their content types.
+# Only saved variants are listed: graphs saved before their variants have none until they are drawn again
+def get_graph_sources(portfolio: Portfolio, name: Optional[str]) -> dict[str, Union[str, list[tuple[str, str]]]]:
+    sources = {'url': get_graph_url(portfolio, name), 'srcsets': []}
+    if name and name.startswith(GRAPHS_ROOT + '/') and posixpath.splitext(name)[1][1:] in RASTER_EXTENSIONS:
+        for extension in get_variant_extensions():
+            variants = [(get_graph_variant_name(name, width, extension), width) for width in GRAPH_VARIANT_WIDTHS]
+            srcset = ', '.join(f'{get_graph_url(portfolio, variant_name)} {width}w'
+                               for variant_name, width in variants if default_storage.exists(variant_name))
+            if srcset:
+                sources['srcsets'].append((CONTENT_TYPES[extension], srcset))
+    return sources
+
+
+def get_portfolio_graph_name(portfolio: Portfolio, file_name: str) -> Optional[str]:
+    variant = VARIANT_FILE_NAME.match(file_name)
+    for field in GRAPH_FIELDS:
+        name = getattr(portfolio, field).name
+        if not name:
+            continue
+        if posixpath.basename(name) == file_name:
+            return name
+        if variant and posixpath.basename(name).startswith(variant['digest'] + '.'):
+            variant_name = posixpath.join(posixpath.dirname(name), file_name)
+            return variant_name if default_storage.exists(variant_name) else None
+    return None
+
+
+# Content-addressed names never change their content, other names are revalidated by browsers
+def get_graph_response(request: HttpRequest, name: str) -> HttpResponse:
+    is_immutable = name.startswith(GRAPHS_ROOT + '/')
+    etag = f'"{posixpath.splitext(posixpath.basename(name))[0]}"'
+    headers = {'ETag': etag, 'Cache-Control': IMMUTABLE_CACHE_CONTROL if is_immutable else 'private, no-cache'}
+    if is_etag_matched(request, etag):
+        response = HttpResponseNotModified()
+    elif GRAPH_SENDFILE_HEADER == 'X-Accel-Redirect':
+        response = HttpResponse(content_type=CONTENT_TYPES.get(posixpath.splitext(name)[1][1:]))
+        response[GRAPH_SENDFILE_HEADER] = GRAPH_ACCEL_REDIRECT_ROOT + name
+    elif GRAPH_SENDFILE_HEADER == 'X-Sendfile':
+        response = HttpResponse(content_type=CONTENT_TYPES.get(posixpath.splitext(name)[1][1:]))
+        response[GRAPH_SENDFILE_HEADER] = default_storage.path(name)
+    else:
+        response = FileResponse(default_storage.open(name), content_type=CONTENT_TYPES.get(posixpath.splitext(name)[1][1:]))
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def get_referenced_graph_names() -> set[str]:
+    names = set()
+    for row in Portfolio.objects.values_list(*GRAPH_FIELDS).iterator():
+        names.update(x for x in row if x)
+    return names
+
+
+def iterate_graph_names() -> Iterator[str]:
+    for first_shard in _list_directories(GRAPHS_ROOT):
+        for second_shard in _list_directories(posixpath.join(GRAPHS_ROOT, first_shard)):
+            shard = posixpath.join(GRAPHS_ROOT, first_shard, second_shard)
+            for file_name in default_storage.listdir(shard)[1]:
+                yield posixpath.join(shard, file_name)
+
+
+# Fresh files are kept: a graph may be saved but not yet referenced by its portfolio. References are read
+# again right before deleting, so a file reused while the storage was listed is kept
+def collect_graph_garbage(min_age: datetime.timedelta = GRAPH_GARBAGE_MIN_AGE) -> int:
+    referenced = get_referenced_graph_names()
+    referenced_digests = {_get_digest(name) for name in referenced}
+    expired = timezone.now() - min_age
+    garbage = [name for name in iterate_graph_names()
+               if _get_digest(name) not in referenced_digests and default_storage.get_modified_time(name) < expired]
+    referenced_digests = {_get_digest(name) for name in get_referenced_graph_names()}
+    deleted = 0
+    for name in garbage:
+        if _get_digest(name) not in referenced_digests:
+            default_storage.delete(name)
+            deleted += 1
+    deleted += _delete_legacy_graphs(referenced)
+    return deleted
+
+
+# Graphs of the old layout were saved to portfolio_graph/<pk>/ under fixed names
+def _delete_legacy_graphs(referenced: set[str]) -> int:
+    deleted = 0
+    for directory in _list_directories(LEGACY_GRAPHS_ROOT):
+        path = posixpath.join(LEGACY_GRAPHS_ROOT, directory)
+        for file_name in default_storage.listdir(path)[1]:
+            name = posixpath.join(path, file_name)
+            if name not in referenced:
+                default_storage.delete(name)
+                deleted += 1
+    return deleted
+
+
+# Variants share the digest of their graph
+def _get_digest(name: str) -> str:
+    return posixpath.splitext(posixpath.basename(name))[0].split('-')[0]
+
+
+def _list_directories(path: str) -> list[str]:
+    if not default_storage.exists(path):
+        return []
+    return default_storage.listdir(path)[0]
@@ -0,0 +1,28 @@
+from io import BytesIO
+from typing import Iterator
+
+from PIL import Image
+
+from config.settings import GRAPH_VARIANT_WIDTHS, GRAPH_AVIF
+
+VARIANT_SAVE_OPTIONS = {'avif': {'quality': 60}, 'webp': {'quality': 80, 'method': 6}}
+
+
+# AVIF is saved only if Pillow is built with it (Pillow 11.2+ or pillow-avif-plugin)
+def get_variant_extensions() -> list[str]:
+    extensions = ['webp']
+    if GRAPH_AVIF and 'AVIF' in Image.SAVE:
+        extensions.insert(0, 'avif')
+    return extensions
+
+
+# Smaller compressed copies of a raster graph for srcset: (width, extension, content)
+def render_graph_variants(content: bytes) -> Iterator[tuple[int, str, bytes]]:
+    image = Image.open(BytesIO(content))
+    image.load()
+    for width in GRAPH_VARIANT_WIDTHS:
+        resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+        for extension in get_variant_extensions():
+            buffer = BytesIO()
+            resized.save(buffer, format=extension.upper(), **VARIANT_SAVE_OPTIONS[extension])
+            yield width, extension, buffer.getvalue()
@@ -0,0 +1,121 @@
+import io
+import csv
+from decimal import Decimal, InvalidOperation
+from typing import Iterable, Iterator, Optional
+
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+
+from .models import Portfolio, PortfolioItem
+from .catalog import get_security_catalog
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_ERRORS = 100
+
+TICKER_COLUMNS = ('ticker', 'symbol', 'тикер')
+FIGI_COLUMNS = ('figi',)
+QUANTITY_COLUMNS = ('quantity', 'qty', 'amount', 'количество')
+
+
+class PortfolioItemsImporter:
+    # Quantities of one security in several rows (lots) are summed. Imported securities replace quantities
+    # of the same securities in portfolio, other portfolio items are kept.
+    def __init__(self, portfolio: Portfolio) -> None:
+        self._portfolio = portfolio
+        self._quantities: dict[int, int] = {}
+        self._imported_rows = 0
+        self._errors: list[str] = []
+
+    def import_file(self, file: UploadedFile) -> bool:
+        text = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+        rows = self._read_rows(text)
+        with transaction.atomic():
+            for chunk in _get_chunks(rows, IMPORT_CHUNK_SIZE):
+                self._import_chunk(chunk)
+        text.detach()
+        return not self._errors
+
+    def _read_rows(self, text: io.TextIOWrapper) -> Iterator[tuple[int, str, str, str]]:
+        header = text.readline()
+        reader = csv.reader(text, delimiter=';' if header.count(';') > header.count(',') else ',')
+        columns = [x.strip().lower() for x in next(csv.reader([header], delimiter=reader.dialect.delimiter), [])]
+        ticker_i = _find_column(columns, TICKER_COLUMNS)
+        figi_i = _find_column(columns, FIGI_COLUMNS)
+        quantity_i = _find_column(columns, QUANTITY_COLUMNS)
+        if quantity_i is None or (ticker_i is None and figi_i is None):
+            self._add_error('Header must contain ticker or FIGI and quantity columns')
+            return
+        for line_number, row in enumerate(reader, start=2):
+            if not any(row):
+                continue
+            ticker = _get_cell(row, ticker_i)
+            figi = _get_cell(row, figi_i)
+            yield line_number, figi or ticker, ticker, _get_cell(row, quantity_i)
+
+    def _import_chunk(self, chunk: list[tuple[int, str, str, str]]):
+        catalog = get_security_catalog()
+        touched = set()
+        for line_number, key, ticker, quantity in chunk:
+            record = catalog.find(key) or catalog.find(ticker)
+            security_pk = record.pk if record else None
+            try:
+                value = Decimal(quantity.replace(' ', '').replace(',', '.'))
+            except InvalidOperation:
+                self._add_error(f'Line {line_number}: quantity {quantity} is not a number')
+                continue
+            if not value.is_finite() or value != value.to_integral_value():
+                self._add_error(f'Line {line_number}: quantity {quantity} is not a whole number')
+                continue
+            if security_pk is None:
+                self._add_error(f'Line {line_number}: security {key} is not found')
+            elif value <= 0:
+                self._add_error(f'Line {line_number}: quantity must be positive')
+            elif self._quantities.get(security_pk, 0) + value > PortfolioItem.MAX_QUANTITY:
+                self._add_error(f'Line {line_number}: quantity must not exceed {PortfolioItem.MAX_QUANTITY}')
+            else:
+                self._quantities[security_pk] = self._quantities.get(security_pk, 0) + int(value)
+                touched.add(security_pk)
+                self._imported_rows += 1
+        items = [PortfolioItem(portfolio=self._portfolio, security_id=x, quantity=self._quantities[x]) for x in touched]
+        PortfolioItem.objects.bulk_create(items, update_conflicts=True, unique_fields=['portfolio', 'security'],
+                                          update_fields=['quantity'])
+
+    def _add_error(self, error: str):
+        if len(self._errors) < IMPORT_MAX_ERRORS:
+            self._errors.append(error)
+
+    @property
+    def imported_rows(self) -> int:
+        return self._imported_rows
+
+    @property
+    def imported_securities(self) -> int:
+        return len(self._quantities)
+
+    @property
+    def errors(self) -> list[str]:
+        return self._errors
+
+
+def _get_chunks(rows: Iterable, size: int) -> Iterator[list]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _find_column(columns: list[str], names: tuple[str, ...]) -> Optional[int]:
+    for i, column in enumerate(columns):
+        if column in names:
+            return i
+    return None
+
+
+def _get_cell(row: list[str], i: Optional[int]) -> str:
+    if i is None or i >= len(row):
+        return ''
+    return row[i].strip()
@@ -0,0 +1,50 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from config.settings import LIVE_PRICE_TIMEOUT
+from .models import Security, SecurityPriceHistory
+from .versions import bump_security_portfolios_versions
+
+
+def get_live_price_key(figi: str) -> str:
+    return f'live_price:{figi}'
+
+
+# Streamed prices are written in one bulk update and shared with other processes through the cache
+def save_live_prices(prices: dict[str, Decimal]) -> int:
+    now = timezone.now()
+    today = now.date()
+    securities = list(Security.objects.filter(figi__in=list(prices)))
+    for security in securities:
+        security.price = prices[security.figi]
+        security.price_updated_at = now
+        security.last_updated = today
+    history = [SecurityPriceHistory(security=x, date=today, close_price=x.price) for x in securities]
+    with transaction.atomic():
+        Security.objects.bulk_update(securities, ['price', 'price_updated_at', 'last_updated'], batch_size=500)
+        SecurityPriceHistory.objects.bulk_create(history, batch_size=500, update_conflicts=True,
+                                                 unique_fields=['security', 'date'], update_fields=['close_price'])
+    cache.set_many({get_live_price_key(x.figi): (x.price, now) for x in securities}, LIVE_PRICE_TIMEOUT)
+    bump_security_portfolios_versions([x.pk for x in securities])
+    return len(securities)
+
+
+# Sets a streamed price newer than the saved one without asking the broker, the stream saves it later
+def apply_live_price(security: Security) -> bool:
+    live_price = cache.get(get_live_price_key(security.figi))
+    if live_price is None:
+        return False
+    price, updated_at = live_price
+    if security.price_updated_at is not None and updated_at <= security.price_updated_at:
+        return False
+    security.price = price
+    security.price_updated_at = updated_at
+    return True
+
+
+def get_held_figis() -> set[str]:
+    return set(Security.objects.filter(portfolioitem__isnull=False, not_found_on_market=False)
+               .values_list('figi', flat=True).distinct())
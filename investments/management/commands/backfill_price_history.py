@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from investments.covariance import ReturnCovarianceService
+from investments.models import Security
+from investments.tinkoff_client import TinvestPriceHistoryLoader
+from investments.utils import get_today
+
+
+class Command(BaseCommand):
+    help = 'Load day candles from Tinvest into the security price history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=365, help='How many days back to load')
+        parser.add_argument('--all', action='store_true', help='Load all securities, not only held ones')
+        parser.add_argument('--full', action='store_true', help='Reload the whole period, not only missing days')
+        parser.add_argument('--figi', nargs='*', help='Load only these FIGIs')
+
+    def handle(self, *args, **options):
+        securities = Security.objects.filter(not_found_on_market=False)
+        if options['figi']:
+            securities = securities.filter(figi__in=options['figi'])
+        elif not options['all']:
+            securities = securities.filter(portfolioitem__isnull=False).distinct()
+        date_to = get_today()
+        date_from = date_to - timedelta(days=options['days'])
+        TinvestPriceHistoryLoader().backfill(list(securities), date_from, date_to, incremental=not options['full'])
+        ReturnCovarianceService().update()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from investments.graph_storage import collect_graph_garbage
+
+
+class Command(BaseCommand):
+    help = 'Delete graph files no portfolio refers to'
+
+    def handle(self, *args, **options):
+        deleted = collect_graph_garbage()
+        print(f'$$ Deleted {deleted} graph files')
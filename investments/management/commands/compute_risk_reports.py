@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from investments.models import Portfolio
+from investments.risk import PortfolioRiskSimulator
+
+
+class Command(BaseCommand):
+    help = 'Simulate value-at-risk and expected shortfall for portfolios which changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--portfolio', type=int, nargs='*', help='Simulate only these portfolio pks')
+        parser.add_argument('--workers', type=int, help='Number of simulation processes, all cores by default')
+
+    def handle(self, *args, **options):
+        portfolios = Portfolio.objects.order_by('pk')
+        if options['portfolio']:
+            portfolios = portfolios.filter(pk__in=options['portfolio'])
+        for portfolio in portfolios:
+            report = PortfolioRiskSimulator(portfolio, max_workers=options['workers']).get_report()
+            print('$$ Risk report:', portfolio.pk, '-', 'ready' if report else 'not enough price history')
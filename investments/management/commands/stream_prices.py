@@ -0,0 +1,15 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from investments.price_stream import PriceStreamSubscriber
+
+
+class Command(BaseCommand):
+    help = 'Subscribe to streamed prices of held securities and keep them saved'
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(PriceStreamSubscriber().run())
+        except KeyboardInterrupt:
+            print('$$ Price stream is stopped')
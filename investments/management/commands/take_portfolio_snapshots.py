@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from investments.snapshots import PortfolioSnapshotWriter
+
+
+class Command(BaseCommand):
+    help = 'Save today valuation snapshot of every portfolio'
+
+    def handle(self, *args, **options):
+        PortfolioSnapshotWriter().write()
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from investments.covariance import ReturnCovarianceService
+
+
+class Command(BaseCommand):
+    help = 'Append new daily returns of held securities to the cached covariance matrix'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Recalculate the whole window')
+
+    def handle(self, *args, **options):
+        covariance = ReturnCovarianceService().update(rebuild=options['rebuild'])
+        print('$$ Covariance:', len(covariance.figis), 'securities,', covariance.count, 'days')
@@ -0,0 +1,43 @@
+from io import BytesIO
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+# Figures are made without pyplot: its global state is not thread-safe and graphs are also drawn
+# by the debounced renders in scheduler threads
+class MatplotlibPieRenderer:
+    extension = 'png'
+
+    def __init__(self):
+        self._fig = None
+        self._axe = None
+
+    def draw(self, labels: list[str], costs: list):
+        self._fig = self._create_figure()
+        self._axe = self._fig.subplots()
+        self._axe.pie(costs, labels=labels, autopct='%1.1f%%')
+
+    def draw_composite(self, charts: list[tuple[str, list[str], list]]):
+        self._fig = self._create_figure(figsize=(18, 10))
+        axes = self._fig.subplots(2, 3)
+        for axe, (title, labels, costs) in zip(axes.flat, charts):
+            axe.pie(costs, labels=labels, autopct='%1.1f%%')
+            axe.set_title(title)
+        for axe in axes.flat[len(charts):]:
+            axe.axis('off')
+
+    def get_content(self) -> bytes:
+        buffer = BytesIO()
+        self._fig.savefig(buffer, format=self.extension)
+        return buffer.getvalue()
+
+    def close(self):
+        self._fig = None
+        self._axe = None
+
+    @staticmethod
+    def _create_figure(**kwargs) -> Figure:
+        figure = Figure(**kwargs)
+        FigureCanvasAgg(figure)
+        return figure
@@ -0,0 +1,29 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0017_portfolio_market_graph'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRateHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('currency', models.CharField(choices=[('EUR', 'EUR'), ('RUB', 'RUB'), ('USD', 'USD')], max_length=3, verbose_name='Currency')),
+                ('rate', models.DecimalField(decimal_places=4, max_digits=10, verbose_name='Rate to USD')),
+            ],
+            options={
+                'ordering': ['currency', 'date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='exchangeratehistory',
+            constraint=models.UniqueConstraint(fields=('currency', 'date'), name='unique_exchange_rate_currency_date'),
+        ),
+    ]
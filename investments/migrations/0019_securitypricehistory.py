@@ -0,0 +1,34 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0018_exchangeratehistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SecurityPriceHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('close_price', models.DecimalField(decimal_places=4, max_digits=12, verbose_name='Close price')),
+                ('security', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='investments.security')),
+            ],
+            options={
+                'ordering': ['security', 'date'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='securitypricehistory',
+            index=models.Index(fields=['date', 'security'], name='security_price_history_date'),
+        ),
+        migrations.AddConstraint(
+            model_name='securitypricehistory',
+            constraint=models.UniqueConstraint(fields=('security', 'date'), name='unique_security_price_history_date'),
+        ),
+    ]
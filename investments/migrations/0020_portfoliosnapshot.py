@@ -0,0 +1,33 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0019_securitypricehistory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('total_value', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='Total value, USD')),
+                ('net_flow', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Net flow, USD')),
+                ('positions', models.JSONField(default=dict, verbose_name='Quantity and USD price by security pk')),
+                ('breakdown', models.JSONField(default=dict, verbose_name='Costs by dimension, USD')),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='investments.portfolio')),
+            ],
+            options={
+                'ordering': ['portfolio', 'date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='portfoliosnapshot',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'date'), name='unique_portfolio_snapshot_date'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0020_portfoliosnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TargetAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dimension', models.CharField(choices=[('security', 'Security'), ('sector', 'Sector'), ('country', 'Country'), ('market', 'Market'), ('currency', 'Currency')], max_length=10, verbose_name='Dimension')),
+                ('label', models.CharField(max_length=100, verbose_name='Label')),
+                ('weight', models.DecimalField(decimal_places=2, max_digits=5, verbose_name='Target weight, %')),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='investments.portfolio')),
+            ],
+            options={
+                'ordering': ['portfolio', 'dimension', 'label'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='targetallocation',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'dimension', 'label'), name='unique_target_allocation_label'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+from django.db import migrations, models
+
+
+def merge_duplicate_items(apps, schema_editor):
+    PortfolioItem = apps.get_model('investments', 'PortfolioItem')
+    kept = {}
+    for item in PortfolioItem.objects.order_by('pk'):
+        key = (item.portfolio_id, item.security_id)
+        if key in kept:
+            kept[key].quantity += item.quantity
+            kept[key].save()
+            item.delete()
+        else:
+            kept[key] = item
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0021_targetallocation'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='portfolioitem',
+            constraint=models.UniqueConstraint(fields=('portfolio', 'security'), name='unique_portfolio_item_security'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0022_portfolioitem_unique_security'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Version'),
+        ),
+    ]
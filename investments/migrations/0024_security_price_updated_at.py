@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0023_portfolio_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='security',
+            name='price_updated_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Price update time'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.1.13 on 2026-10-19 13:38
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('investments', '0024_security_price_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='targetallocation',
+            name='weight',
+            field=models.DecimalField(decimal_places=2, max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)], verbose_name='Target weight, %'),
+        ),
+    ]
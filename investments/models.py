@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.validators import MinValueValidator, MaxValueValidator
 from django.contrib.auth.models import User
 
 
@@ -36,6 +37,7 @@ class Security(models.Model):
     country = models.CharField('Country', max_length=20, null=True, blank=True)
     not_found_on_market = models.BooleanField('Is not found on market?', default=False)
     last_updated = models.DateField('Last update', auto_now=True)
+    price_updated_at = models.DateTimeField('Price update time', null=True, blank=True)
 
     class Meta:
         ordering = ['ticker']
@@ -47,12 +49,45 @@ class Security(models.Model):
         return self.name
 
 
+class SecurityPriceHistory(models.Model):
+    security = models.ForeignKey(Security, on_delete=models.CASCADE)
+    date = models.DateField('Date')
+    close_price = models.DecimalField('Close price', max_digits=12, decimal_places=4)
+
+    class Meta:
+        ordering = ['security', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['security', 'date'], name='unique_security_price_history_date')
+        ]
+        indexes = [
+            models.Index(fields=['date', 'security'], name='security_price_history_date')
+        ]
+
+    def __str__(self):
+        return f'{self.security_id} {self.date}: {self.close_price}'
+
+
 class ExchangeRate(models.Model):
     last_updated = models.DateField('Last update', auto_now=True)
     eur_rate = models.DecimalField('EUR rate', max_digits=10, decimal_places=4)
     rub_rate = models.DecimalField('RUB rate', max_digits=10, decimal_places=4)
 
 
+class ExchangeRateHistory(models.Model):
+    date = models.DateField('Date')
+    currency = models.CharField('Currency', max_length=3, choices=Security.currency_choice)
+    rate = models.DecimalField('Rate to USD', max_digits=10, decimal_places=4)
+
+    class Meta:
+        ordering = ['currency', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='unique_exchange_rate_currency_date')
+        ]
+
+    def __str__(self):
+        return f'{self.currency} {self.date}: {self.rate}'
+
+
 class Portfolio(models.Model):
     investor = models.ForeignKey(User, on_delete=models.CASCADE)
     name = models.CharField('Portfolio name', max_length=100)
@@ -62,15 +97,66 @@ class Portfolio(models.Model):
     market_graph = models.ImageField('Market pie graph', upload_to='portfolio_graph', null=True)  # displays countries joined in markets exclude USA and Russia
     currency_graph = models.ImageField('Currency pie graph', upload_to='portfolio_graph', null=True)
     last_updated = models.DateField('Last update', auto_now=True)
+    version = models.PositiveIntegerField('Version', default=0)  # bumped on any change of items or their prices
 
     def __str__(self):
         return self.name
 
 
 class PortfolioItem(models.Model):
+    MAX_QUANTITY = 2 ** 31 - 1  # IntegerField range
+
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
     security = models.ForeignKey(Security, on_delete=models.CASCADE)
     quantity = models.IntegerField('Quantity')
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'security'], name='unique_portfolio_item_security')
+        ]
+
     def __str__(self):
         return self.security.name
+
+
+class TargetAllocation(models.Model):
+    dimension_choice = (
+        ('security', 'Security'),
+        ('sector', 'Sector'),
+        ('country', 'Country'),
+        ('market', 'Market'),
+        ('currency', 'Currency')
+    )
+
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    dimension = models.CharField('Dimension', max_length=10, choices=dimension_choice)
+    label = models.CharField('Label', max_length=100)  # ticker for security, graph label for other dimensions
+    weight = models.DecimalField('Target weight, %', max_digits=5, decimal_places=2,
+                                 validators=[MinValueValidator(0), MaxValueValidator(100)])
+
+    class Meta:
+        ordering = ['portfolio', 'dimension', 'label']
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'dimension', 'label'], name='unique_target_allocation_label')
+        ]
+
+    def __str__(self):
+        return f'{self.label}: {self.weight}%'
+
+
+class PortfolioSnapshot(models.Model):
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE)
+    date = models.DateField('Date')
+    total_value = models.DecimalField('Total value, USD', max_digits=16, decimal_places=2)
+    net_flow = models.DecimalField('Net flow, USD', max_digits=16, decimal_places=2, default=0)  # value of quantity changes since the previous snapshot
+    positions = models.JSONField('Quantity and USD price by security pk', default=dict)
+    breakdown = models.JSONField('Costs by dimension, USD', default=dict)
+
+    class Meta:
+        ordering = ['portfolio', 'date']
+        constraints = [
+            models.UniqueConstraint(fields=['portfolio', 'date'], name='unique_portfolio_snapshot_date')
+        ]
+
+    def __str__(self):
+        return f'{self.portfolio} {self.date}: {self.total_value}'
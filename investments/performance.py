@@ -0,0 +1,100 @@
+import datetime
+from typing import Iterable, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .models import Portfolio, PortfolioSnapshot
+
+TRADING_DAYS_PER_YEAR = 252
+
+
+# All functions accept one series (dates,) or a matrix (portfolios, dates) and keep that shape
+def get_period_returns(values: np.ndarray, flows: np.ndarray) -> np.ndarray:
+    values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+    flows = np.atleast_2d(np.asarray(flows, dtype=np.float64))
+    returns = np.zeros_like(values)
+    previous = values[:, :-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[:, 1:] = np.where(previous > 0, (values[:, 1:] - flows[:, 1:]) / previous - 1, 0)
+    return returns
+
+
+def get_time_weighted_returns(values: np.ndarray, flows: np.ndarray) -> np.ndarray:
+    return np.cumprod(1 + get_period_returns(values, flows), axis=1) - 1
+
+
+def get_drawdowns(time_weighted_returns: np.ndarray) -> np.ndarray:
+    growth = 1 + np.atleast_2d(time_weighted_returns)
+    return growth / np.maximum.accumulate(growth, axis=1) - 1
+
+
+def get_rolling_volatility(period_returns: np.ndarray, window: int = 20) -> np.ndarray:
+    period_returns = np.atleast_2d(period_returns)
+    volatility = np.full(period_returns.shape, np.nan)
+    if period_returns.shape[1] > window:
+        windows = sliding_window_view(period_returns[:, 1:], window, axis=1)
+        volatility[:, window:] = windows.std(axis=2, ddof=1) * np.sqrt(TRADING_DAYS_PER_YEAR)
+    return volatility
+
+
+def load_snapshot_matrix(portfolio_pks: Iterable[int], date_from: Optional[datetime.date] = None,
+                         date_to: Optional[datetime.date] = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Missing snapshots carry the previous value forward with zero flow
+    portfolio_pks = list(portfolio_pks)
+    snapshots = PortfolioSnapshot.objects.filter(portfolio__in=portfolio_pks)
+    if date_from is not None:
+        snapshots = snapshots.filter(date__gte=date_from)
+    if date_to is not None:
+        snapshots = snapshots.filter(date__lte=date_to)
+    rows = list(snapshots.values_list('portfolio', 'date', 'total_value', 'net_flow').iterator(chunk_size=5000))
+    dates = np.array(sorted({x[1] for x in rows}), dtype='datetime64[D]')
+    values = np.full((len(portfolio_pks), len(dates)), np.nan)
+    flows = np.zeros((len(portfolio_pks), len(dates)))
+    if rows:
+        row_index = {pk: i for i, pk in enumerate(portfolio_pks)}
+        portfolio_positions = np.array([row_index[x[0]] for x in rows], dtype=np.int64)
+        date_positions = np.searchsorted(dates, np.array([x[1] for x in rows], dtype='datetime64[D]'))
+        values[portfolio_positions, date_positions] = np.array([x[2] for x in rows], dtype=np.float64)
+        flows[portfolio_positions, date_positions] = np.array([x[3] for x in rows], dtype=np.float64)
+    return dates, fill_forward(values), flows
+
+
+def fill_forward(values: np.ndarray) -> np.ndarray:
+    known = ~np.isnan(values)
+    positions = np.where(known, np.arange(values.shape[1]), 0)
+    np.maximum.accumulate(positions, axis=1, out=positions)
+    filled = values[np.arange(values.shape[0])[:, None], positions]
+    return np.nan_to_num(filled, nan=0.0)
+
+
+class PortfolioPerformance:
+    def __init__(self, portfolio: Portfolio, date_from: Optional[datetime.date] = None):
+        self._dates, values, flows = load_snapshot_matrix([portfolio.pk], date_from)
+        period_returns = get_period_returns(values, flows)
+        self._returns = get_time_weighted_returns(values, flows)[0]
+        self._drawdowns = get_drawdowns(self._returns)[0]
+        self._volatility = get_rolling_volatility(period_returns)[0]
+
+    @property
+    def is_empty(self) -> bool:
+        return len(self._dates) < 2
+
+    @property
+    def total_return(self) -> Optional[float]:
+        return None if self.is_empty else float(self._returns[-1])
+
+    @property
+    def max_drawdown(self) -> Optional[float]:
+        return None if self.is_empty else float(self._drawdowns.min())
+
+    @property
+    def volatility(self) -> Optional[float]:
+        if self.is_empty or np.isnan(self._volatility[-1]):
+            return None
+        return float(self._volatility[-1])
+
+    @property
+    def series(self) -> dict[str, list]:
+        return {'dates': [str(x) for x in self._dates], 'returns': self._returns.tolist(),
+                'drawdowns': self._drawdowns.tolist(), 'volatility': self._volatility.tolist()}
@@ -0,0 +1,75 @@
+import datetime
+from decimal import Decimal
+from typing import Iterable, Optional
+
+import numpy as np
+
+from .models import Security, SecurityPriceHistory
+from .performance import fill_forward
+
+
+def record_security_price(security: Security, date: datetime.date, price: Decimal):
+    SecurityPriceHistory.objects.update_or_create(security=security, date=date, defaults={'close_price': price})
+
+
+def save_price_history(security: Security, prices: Iterable[tuple[datetime.date, Decimal]]) -> int:
+    rows = [SecurityPriceHistory(security=security, date=date, close_price=price) for date, price in prices]
+    SecurityPriceHistory.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+    return len(rows)
+
+
+def get_last_price_date(security: Security) -> Optional[datetime.date]:
+    return SecurityPriceHistory.objects.filter(security=security).order_by('-date') \
+        .values_list('date', flat=True).first()
+
+
+def get_price_history(figi: str, date_from: datetime.date, date_to: datetime.date) \
+        -> tuple[np.ndarray, np.ndarray]:
+    rows = SecurityPriceHistory.objects.filter(security__figi=figi, date__range=(date_from, date_to)) \
+        .order_by('date').values_list('date', 'close_price')
+    return _unpack_price_rows(rows)
+
+
+def get_price_history_matrix(figis: list[str], date_from: datetime.date, date_to: datetime.date) \
+        -> tuple[np.ndarray, np.ndarray]:
+    # Rows are dates traded by any of figis, columns follow figis order; missing closes are NaN
+    column = {figi: i for i, figi in enumerate(figis)}
+    rows = list(SecurityPriceHistory.objects.filter(security__figi__in=figis, date__range=(date_from, date_to))
+                .values_list('date', 'security__figi', 'close_price').iterator(chunk_size=5000))
+    dates = np.array(sorted({x[0] for x in rows}), dtype='datetime64[D]')
+    prices = np.full((len(dates), len(figis)), np.nan)
+    if rows:
+        date_positions = np.searchsorted(dates, np.array([x[0] for x in rows], dtype='datetime64[D]'))
+        figi_positions = np.array([column[x[1]] for x in rows], dtype=np.int64)
+        prices[date_positions, figi_positions] = np.array([x[2] for x in rows], dtype=np.float64)
+    return dates, prices
+
+
+def get_usd_price_matrix(securities: list[Security], date_from: datetime.date, date_to: datetime.date,
+                         rates_index) -> tuple[np.ndarray, np.ndarray]:
+    # rates_index is an ExchangeRateHistoryIndex, it is passed in since exchanger depends on this module
+    dates, prices = get_price_history_matrix([x.figi for x in securities], date_from, date_to)
+    day_dates = dates.tolist()
+    for i, security in enumerate(securities):
+        rates = rates_index.get_rates(security.currency, day_dates)
+        known = ~np.isnan(rates)
+        if known.any():
+            # Rates history may start later than prices history
+            rates[~known] = rates[known][0]
+            prices[:, i] /= rates
+    return dates, prices
+
+
+def get_returns(prices: np.ndarray) -> np.ndarray:
+    # Gaps in prices are filled by the previous close, days before the first close have zero return
+    prices = fill_forward(prices.T).T
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = prices[1:] / prices[:-1] - 1
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def _unpack_price_rows(rows: Iterable[tuple[datetime.date, Decimal]]) -> tuple[np.ndarray, np.ndarray]:
+    rows = list(rows)
+    dates = np.array([x[0] for x in rows], dtype='datetime64[D]')
+    prices = np.array([x[1] for x in rows], dtype=np.float64)
+    return dates, prices
@@ -0,0 +1,135 @@
+import asyncio
+from decimal import Decimal
+from typing import Optional
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from tinvest.constants import STREAMING
+
+from config.settings import TINVEST_TOKEN, PRICE_STREAM_FLUSH_INTERVAL, PRICE_STREAM_RECONCILE_INTERVAL
+from .live_prices import save_live_prices, get_held_figis
+
+
+# Keeps minute candles of every held FIGI subscribed and saves their close prices in periodic bulk writes
+class PriceStreamSubscriber:
+    def __init__(self, url: str = STREAMING, token: Optional[str] = TINVEST_TOKEN,
+                 flush_interval: float = PRICE_STREAM_FLUSH_INTERVAL,
+                 reconcile_interval: float = PRICE_STREAM_RECONCILE_INTERVAL, reconnect_timeout: float = 3):
+        self._url = url
+        self._token = token
+        self._flush_interval = flush_interval
+        self._reconcile_interval = reconcile_interval
+        self._reconnect_timeout = reconnect_timeout
+        self._prices: dict[str, Decimal] = {}
+        self._changed: set[str] = set()
+        self._subscribed: set[str] = set()
+        self._stopping: Optional[asyncio.Event] = None
+        self._ready: Optional[asyncio.Event] = None
+
+    async def run(self):
+        self._stopping = asyncio.Event()
+        self._ready = asyncio.Event()
+        headers = {'Authorization': f'Bearer {self._token}'}
+        async with aiohttp.ClientSession(headers=headers) as session:
+            while not self._stopping.is_set():
+                try:
+                    async with session.ws_connect(self._url, heartbeat=30) as ws:
+                        await self._serve(ws)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    print('$$ Price stream error:', e)
+                    await self._wait_stopping(self._reconnect_timeout)
+                except Exception as e:
+                    # Anything else, e.g. a database error while reconciling, reconnects instead of ending the stream
+                    print('$$ Price stream failed:', repr(e))
+                    await self._wait_stopping(self._reconnect_timeout)
+        try:
+            await self.flush()
+        except Exception as e:
+            print('$$ Price stream last flush failed:', repr(e))
+
+    def stop(self):
+        self._stopping.set()
+
+    async def wait_ready(self):
+        await self._ready.wait()
+
+    async def _serve(self, ws: aiohttp.ClientWebSocketResponse):
+        self._subscribed = set()
+        await self.reconcile(ws)
+        self._ready.set()
+        tasks = [asyncio.create_task(x) for x in (self._read(ws), self._flush_periodically(),
+                                                  self._reconcile_periodically(ws), self._stopping.wait())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        for task in done:
+            task.result()
+
+    async def _read(self, ws: aiohttp.ClientWebSocketResponse):
+        async for message in ws:
+            if message.type == aiohttp.WSMsgType.TEXT:
+                try:
+                    self._handle_event(message.json())
+                except (ValueError, KeyError, TypeError, ArithmeticError) as e:
+                    print('$$ Malformed price stream event:', repr(e), message.data)
+            elif message.type == aiohttp.WSMsgType.ERROR:
+                break
+
+    def _handle_event(self, event: dict):
+        if event.get('event') != 'candle':
+            return
+        figi = event['payload']['figi']
+        if figi in self._subscribed:
+            self._prices[figi] = Decimal(str(event['payload']['c']))
+            self._changed.add(figi)
+
+    # Subscriptions follow holdings: new FIGIs are subscribed, sold ones are unsubscribed
+    async def reconcile(self, ws: aiohttp.ClientWebSocketResponse):
+        held = await sync_to_async(get_held_figis)()
+        for figi in sorted(held - self._subscribed):
+            await ws.send_json({'event': 'candle:subscribe', 'figi': figi, 'interval': '1min'})
+        for figi in sorted(self._subscribed - held):
+            await ws.send_json({'event': 'candle:unsubscribe', 'figi': figi, 'interval': '1min'})
+            self._prices.pop(figi, None)
+            self._changed.discard(figi)
+        self._subscribed = held
+
+    async def flush(self) -> int:
+        if not self._changed:
+            return 0
+        prices = {x: self._prices[x] for x in self._changed}
+        self._changed = set()
+        try:
+            return await sync_to_async(save_live_prices)(prices)
+        except Exception:
+            # Prices are saved again by the next flush unless newer ones replace them
+            self._changed |= prices.keys() & self._subscribed
+            raise
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print('$$ Price stream flush failed:', repr(e))
+
+    async def _reconcile_periodically(self, ws: aiohttp.ClientWebSocketResponse):
+        while True:
+            await asyncio.sleep(self._reconcile_interval)
+            await self.reconcile(ws)
+
+    async def _wait_stopping(self, timeout: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    @property
+    def prices(self) -> dict[str, Decimal]:
+        return self._prices
+
+    @property
+    def subscribed(self) -> set[str]:
+        return self._subscribed
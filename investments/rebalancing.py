@@ -0,0 +1,134 @@
+from decimal import Decimal
+from typing import Optional
+
+import numpy as np
+
+from .models import Portfolio, PortfolioItem, Security, TargetAllocation
+from .exchanger import Exchanger
+from .graph import GRAPH_DATA_CALCULATORS, SecurityGraphDataCalculator
+from .utils import get_current_portfolio_items
+
+
+# Holdings with group -1 have no target and are never traded. Group weights are split between the holdings
+# of a group proportionally to their current value. Cash can only be spent, never borrowed, and negative
+# group weights count as zero, so a holding is never sold below zero units.
+def get_rebalancing_trades(prices: np.ndarray, quantities: np.ndarray, groups: np.ndarray,
+                           group_weights: np.ndarray, cash: float, allow_sells: bool = True) -> np.ndarray:
+    prices = np.asarray(prices, dtype=np.float64)
+    quantities = np.asarray(quantities, dtype=np.int64)
+    groups = np.asarray(groups, dtype=np.int64)
+    group_weights = np.clip(np.asarray(group_weights, dtype=np.float64), 0, None)
+    targeted = (groups >= 0) & (prices > 0)
+    trades = np.zeros(len(prices), dtype=np.int64)
+    if not targeted.any() or group_weights.sum() <= 0:
+        return trades
+
+    desired = get_desired_values(prices, quantities, groups, group_weights, cash)
+    values = prices * quantities
+    if allow_sells:
+        trades[targeted] = np.floor(desired[targeted] / prices[targeted]).astype(np.int64) - quantities[targeted]
+    else:
+        shortfall = np.clip(desired - values, 0, None)
+        scale = min(1.0, cash / shortfall.sum()) if shortfall.sum() > 0 else 0.0
+        trades[targeted] = np.floor(shortfall[targeted] * scale / prices[targeted]).astype(np.int64)
+
+    # Spend what flooring left over on single units that bring holdings closest to their targets
+    leftover = cash - float(np.dot(trades, prices))
+    while True:
+        gain = desired - (quantities + trades) * prices - prices / 2
+        gain[~targeted | (prices > leftover)] = -np.inf
+        i = int(np.argmax(gain))
+        if gain[i] <= 0:
+            break
+        trades[i] += 1
+        leftover -= prices[i]
+    return trades
+
+
+def get_desired_values(prices: np.ndarray, quantities: np.ndarray, groups: np.ndarray, group_weights: np.ndarray,
+                       cash: float) -> np.ndarray:
+    values = prices * quantities
+    targeted = (groups >= 0) & (prices > 0)
+    group_weights = np.clip(np.asarray(group_weights, dtype=np.float64), 0, None)
+    weights = group_weights / group_weights.sum()
+    target_groups = groups[targeted]
+    group_values = np.bincount(target_groups, weights=values[targeted], minlength=len(weights))
+    group_counts = np.bincount(target_groups, minlength=len(weights))
+    shares = np.where(group_values[target_groups] > 0,
+                      values[targeted] / np.where(group_values > 0, group_values, 1)[target_groups],
+                      1 / group_counts[target_groups])
+    desired = np.zeros(len(prices))
+    desired[targeted] = weights[target_groups] * shares * (values[targeted].sum() + cash)
+    return desired
+
+
+def get_drift(values: np.ndarray, desired: np.ndarray) -> float:
+    total = values.sum()
+    if total <= 0:
+        return 0.0
+    return float(np.abs(values / total - desired / desired.sum()).sum() / 2) if desired.sum() > 0 else 0.0
+
+
+class PortfolioRebalancer:
+    def __init__(self, portfolio: Portfolio, dimension: str, cash: Decimal, allow_sells: bool = True):
+        self._portfolio = portfolio
+        self._dimension = dimension
+        self._cash = float(cash)
+        self._allow_sells = allow_sells
+        self._exchanger = Exchanger()
+        self._items: list[PortfolioItem] = list(get_current_portfolio_items(portfolio))
+        self._targets = dict(TargetAllocation.objects.filter(portfolio=portfolio, dimension=dimension)
+                             .values_list('label', 'weight'))
+        self._rows = []
+        self._drift_before = None
+        self._drift_after = None
+        self._calculate()
+
+    def _append_targeted_securities(self):
+        if self._dimension != 'security':
+            return
+        held = {x.security.ticker for x in self._items}
+        missing = Security.objects.filter(ticker__in=[x for x in self._targets if x not in held])
+        self._items += [PortfolioItem(portfolio=self._portfolio, security=x, quantity=0) for x in missing]
+
+    def _get_item_prices(self) -> np.ndarray:
+        # Prices are costs of a single unit in USD
+        units = [PortfolioItem(portfolio=self._portfolio, security=x.security, quantity=1) for x in self._items]
+        return np.array(SecurityGraphDataCalculator(self._portfolio, units, self._exchanger).item_costs,
+                        dtype=np.float64)
+
+    def _calculate(self):
+        self._append_targeted_securities()
+        if not self._items:
+            return
+        item_labels = GRAPH_DATA_CALCULATORS[self._dimension](self._portfolio, self._items, self._exchanger).item_labels
+        group_labels = list(self._targets)
+        group_index = {label: i for i, label in enumerate(group_labels)}
+        groups = np.array([group_index.get(x, -1) for x in item_labels], dtype=np.int64)
+        group_weights = np.array([float(self._targets[x]) for x in group_labels], dtype=np.float64)
+        prices = self._get_item_prices()
+        quantities = np.array([x.quantity for x in self._items], dtype=np.int64)
+
+        trades = get_rebalancing_trades(prices, quantities, groups, group_weights, self._cash, self._allow_sells)
+        if group_weights.sum() > 0:
+            desired = get_desired_values(prices, quantities, groups, group_weights, self._cash)
+            self._drift_before = get_drift(prices * quantities * (groups >= 0), desired)
+            self._drift_after = get_drift(prices * (quantities + trades) * (groups >= 0), desired)
+        self._rows = [(item.security.ticker, label, round(price, 2), item.quantity, int(trade), round(price * trade, 2))
+                      for item, label, price, trade in zip(self._items, item_labels, prices, trades)]
+
+    @property
+    def trades(self) -> list[tuple[str, str, float, int, int, float]]:
+        return [x for x in self._rows if x[4] != 0]
+
+    @property
+    def cash_used(self) -> float:
+        return round(sum(x[5] for x in self._rows), 2)
+
+    @property
+    def drift_before(self) -> Optional[float]:
+        return self._drift_before
+
+    @property
+    def drift_after(self) -> Optional[float]:
+        return self._drift_after
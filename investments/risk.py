@@ -0,0 +1,128 @@
+import os
+import hashlib
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import Max
+
+from .models import Portfolio, PortfolioItem, Security, SecurityPriceHistory
+from .exchanger import Exchanger, ExchangeRateHistoryIndex
+from .graph import SecurityGraphDataCalculator
+from .price_history import get_usd_price_matrix, get_returns
+from .utils import get_today
+
+RISK_HORIZONS = (1, 10, 21)  # trading days
+RISK_CONFIDENCE_LEVELS = (0.95, 0.99)
+RISK_SIMULATION_PATHS = 20000
+RISK_HISTORY_DAYS = 730
+RISK_REPORT_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def simulate_losses(returns: np.ndarray, weights: np.ndarray, horizons: tuple[int, ...], paths: int,
+                    seed: Optional[int] = None, max_workers: Optional[int] = None) -> np.ndarray:
+    # Bootstraps whole days of historical returns, so correlations between holdings are kept.
+    # Returns relative losses with shape (paths, len(horizons)).
+    max_workers = max_workers or os.cpu_count() or 1
+    shards = [x for x in np.array_split(np.arange(paths), max_workers) if len(x)]
+    seeds = np.random.SeedSequence(seed).spawn(len(shards))
+    returns = np.ascontiguousarray(returns, dtype=np.float64)
+    memory = shared_memory.SharedMemory(create=True, size=max(returns.nbytes, 1))
+    try:
+        np.ndarray(returns.shape, dtype=np.float64, buffer=memory.buf)[:] = returns
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            futures = [executor.submit(_simulate_shard, memory.name, returns.shape, weights, horizons, len(x), s)
+                       for x, s in zip(shards, seeds)]
+            return np.concatenate([x.result() for x in futures])
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def _simulate_shard(memory_name: str, shape: tuple[int, int], weights: np.ndarray, horizons: tuple[int, ...],
+                    paths: int, seed: np.random.SeedSequence) -> np.ndarray:
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        returns = np.ndarray(shape, dtype=np.float64, buffer=memory.buf)
+        portfolio_returns = np.log1p(returns @ weights)
+        days = np.random.default_rng(seed).integers(0, shape[0], size=(paths, max(horizons)))
+        growth = np.cumsum(portfolio_returns[days], axis=1)
+        return -np.expm1(growth[:, np.array(horizons) - 1])
+    finally:
+        memory.close()
+
+
+def get_risk_measures(losses: np.ndarray, confidence_levels: tuple[float, ...]) -> dict[str, list[float]]:
+    measures = {}
+    for level in confidence_levels:
+        value_at_risk = np.quantile(losses, level, axis=0)
+        tail = np.where(losses >= value_at_risk, losses, np.nan)
+        measures[f'var_{int(level * 100)}'] = value_at_risk.tolist()
+        measures[f'es_{int(level * 100)}'] = np.nanmean(tail, axis=0).tolist()
+    return measures
+
+
+class PortfolioRiskSimulator:
+    def __init__(self, portfolio: Portfolio, paths: int = RISK_SIMULATION_PATHS, max_workers: Optional[int] = None):
+        self._portfolio = portfolio
+        self._paths = paths
+        self._max_workers = max_workers
+        self._items = list(PortfolioItem.objects.filter(portfolio=portfolio).select_related('security'))
+        self._content_hash = get_portfolio_content_hash(portfolio)
+
+    def get_report(self) -> Optional[dict]:
+        report = get_cached_risk_report(self._portfolio, self._content_hash)
+        if report is None:
+            report = self._simulate()
+            if report is not None:
+                cache.set(_get_risk_report_key(self._portfolio, self._content_hash), report, RISK_REPORT_TIMEOUT)
+        return report
+
+    def _get_usd_returns(self) -> np.ndarray:
+        date_to = get_today()
+        date_from = date_to - datetime.timedelta(days=RISK_HISTORY_DAYS)
+        dates, prices = get_usd_price_matrix([x.security for x in self._items], date_from, date_to,
+                                            ExchangeRateHistoryIndex())
+        return get_returns(prices)
+
+    def _simulate(self) -> Optional[dict]:
+        if not self._items:
+            return None
+        returns = self._get_usd_returns()
+        if len(returns) < max(RISK_HORIZONS):
+            return None
+        costs = np.array(SecurityGraphDataCalculator(self._portfolio, self._items, Exchanger()).item_costs,
+                         dtype=np.float64)
+        value = costs.sum()
+        if value <= 0:
+            return None
+        losses = simulate_losses(returns, costs / value, RISK_HORIZONS, self._paths, max_workers=self._max_workers)
+        measures = get_risk_measures(losses, RISK_CONFIDENCE_LEVELS)
+        return {
+            'value': round(float(value), 2),
+            'horizons': list(RISK_HORIZONS),
+            'observations': len(returns),
+            'measures': measures,
+            'rows': list(zip(RISK_HORIZONS, measures['var_95'], measures['es_95'])),
+            'percentiles': {str(x): np.percentile(-losses, x, axis=0).tolist() for x in (1, 5, 25, 50, 75, 95, 99)}
+        }
+
+
+def get_portfolio_content_hash(portfolio: Portfolio) -> str:
+    holdings = sorted(PortfolioItem.objects.filter(portfolio=portfolio).values_list('security__figi', 'quantity'))
+    figis = [x[0] for x in holdings]
+    last_price_date = SecurityPriceHistory.objects.filter(security__figi__in=figis).aggregate(x=Max('date'))['x']
+    content = repr((holdings, str(last_price_date))).encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+def get_cached_risk_report(portfolio: Portfolio, content_hash: Optional[str] = None) -> Optional[dict]:
+    content_hash = content_hash or get_portfolio_content_hash(portfolio)
+    return cache.get(_get_risk_report_key(portfolio, content_hash))
+
+
+def _get_risk_report_key(portfolio: Portfolio, content_hash: str) -> str:
+    return f'risk_report:{portfolio.pk}:{content_hash}'
@@ -0,0 +1,34 @@
+from rest_framework import serializers
+
+from .models import Portfolio, PortfolioItem, Security
+
+
+class PortfolioSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Portfolio
+        fields = ['id', 'name', 'version', 'last_updated']
+        read_only_fields = ['version', 'last_updated']
+
+
+class SecuritySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Security
+        fields = ['id', 'ticker', 'figi', 'name', 'price', 'currency', 'sector', 'country', 'last_updated']
+        read_only_fields = fields
+
+
+class PortfolioItemSerializer(serializers.ModelSerializer):
+    ticker = serializers.CharField(source='security.ticker', read_only=True)
+    quantity = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = PortfolioItem
+        fields = ['id', 'security', 'ticker', 'quantity']
+
+    def validate_security(self, security: Security) -> Security:
+        items = PortfolioItem.objects.filter(portfolio=self.context['portfolio'], security=security)
+        if self.instance is not None:
+            items = items.exclude(pk=self.instance.pk)
+        if items.exists():
+            raise serializers.ValidationError('Security is already in portfolio')
+        return security
@@ -1,25 +1,56 @@
-import shutil
-from typing import Union
+from typing import Callable, Iterable, Optional, Union
 from decimal import Decimal, ROUND_HALF_UP
 
-from django.db.models.fields.files import ImageFieldFile, FileField
+from django.db import transaction
+from django.db.models import F, Case, When, Value, Sum, Count, DecimalField, QuerySet
+from django.db.models.functions import Coalesce
 from django.http.request import QueryDict
 from django.core.handlers.wsgi import WSGIRequest
 from django.utils.functional import SimpleLazyObject
+from rest_framework import serializers
 
-from .models import Portfolio, PortfolioItem
+from .models import Portfolio, PortfolioItem, Security, TargetAllocation
 from .forms import PortfolioItemsCreateForm, PortfolioItemsDeleteForm, PortfolioItemsIncreaseQuantityForm
-from .forms import PortfolioCreateForm
-from .graph import MarketGraphDrawer, CountryGraphDrawer, SecurityGraphDrawer, CurrencyGraphDrawer, SectorGraphDrawer
-from .graph import GraphPath
+from .forms import PortfolioItemBatchFormSet
+from .forms import PortfolioCreateForm, TargetAllocationCreateForm, TargetAllocationDeleteForm, RebalanceForm
+from .graph import get_portfolio_graph_drawers
+from .graph import GRAPH_DATA_CALCULATORS
+from .graph_storage import GRAPH_FIELDS
+from .exchanger import Exchanger
+from .graph_scheduler import GraphRegenerationScheduler
+from .rebalancing import PortfolioRebalancer
+from .catalog import SecurityRecord, get_security_catalog
 from .utils import get_current_portfolio_items, get_today
+from .versions import bump_portfolio_version, get_cached_portfolio_data
 # TODO: hide all graphs funcs in class Graph
 
+BATCH_QUANTITY_FIELDS = {
+    'create': serializers.IntegerField(min_value=1, max_value=PortfolioItem.MAX_QUANTITY),
+    'increase': serializers.IntegerField(min_value=-PortfolioItem.MAX_QUANTITY, max_value=PortfolioItem.MAX_QUANTITY)
+}
+
 
 def get_user_portfolios_list(user: SimpleLazyObject) -> list[Portfolio]:
     return user.portfolio_set.all().order_by('pk')
 
 
+# Totals of all user portfolios in one query: costs are converted to USD by the exchange rates of Exchanger,
+# which makes sure the rates exist, so EUR and RUB holdings are never left out of the sum
+def get_user_portfolios_totals(user: SimpleLazyObject) -> QuerySet:
+    exchanger = Exchanger()
+    cost = F('portfolioitem__security__price') * F('portfolioitem__quantity')
+    usd_cost = Case(
+        When(portfolioitem__security__currency='EUR', then=cost / Value(exchanger.eur_rate)),
+        When(portfolioitem__security__currency='RUB', then=cost / Value(exchanger.rub_rate)),
+        default=cost,
+        output_field=DecimalField(max_digits=20, decimal_places=2)
+    )
+    return get_user_portfolios_list(user).annotate(
+        total_value=Coalesce(Sum(usd_cost), Value(Decimal(0)), output_field=DecimalField(max_digits=20, decimal_places=2)),
+        positions_count=Count('portfolioitem')
+    )
+
+
 def get_empty_creating_portfolio_form() -> PortfolioCreateForm:
     return PortfolioCreateForm()
 
@@ -33,17 +64,17 @@ def create_portfolio(request: WSGIRequest):
         update_portfolio_graphs(new_portfolio)
 
 
-def update_portfolio_graphs_path(portfolio: Portfolio):
-    graphs_name = ('security', 'sector', 'country', 'market', 'currency')
-    graphs_path = [GraphPath(portfolio.pk, x).graph_path for x in graphs_name]
-    graphs = [portfolio.securities_graph, portfolio.sector_graph, portfolio.country_graph, portfolio.market_graph, portfolio.currency_graph]
-    for i, graph in enumerate(graphs):
-        graph = ImageFieldFile(instance=None, name=graphs_path[i], field=FileField())
-    portfolio.save()
+def update_portfolio_graphs_path(portfolio: Portfolio, graph_names: list[str]):
+    # Composite graph is one file, so every graph field points to it
+    if len(graph_names) == 1:
+        graph_names = graph_names * len(GRAPH_FIELDS)
+    for field, name in zip(GRAPH_FIELDS, graph_names):
+        setattr(portfolio, field, name)
+    portfolio.save(update_fields=[*GRAPH_FIELDS, 'last_updated'])
 
 
+# Graph files may be shared with other portfolios, unreferenced ones are deleted by collect_graph_garbage
 def delete_portfolio(portfolio: Portfolio):
-    shutil.rmtree(GraphPath(portfolio.pk, 'security').graph_full_root, ignore_errors=True)
     portfolio.delete()
 
 
@@ -64,19 +95,21 @@ class PortfolioItemViewHandler:
     def _create_portfolio_item(self, post: QueryDict):
         form_creating = PortfolioItemsCreateForm(self._portfolio, post)
         if form_creating.is_valid():
-            security = form_creating.cleaned_data['security_select']
+            security_pk = form_creating.cleaned_data['security_select']
             quantity = int(form_creating.cleaned_data['quantity'])
             if quantity > 0:
-                item = PortfolioItem(portfolio=self._portfolio, security=security, quantity=quantity)
+                item = PortfolioItem(portfolio=self._portfolio, security_id=security_pk, quantity=quantity)
                 item.save()
-            update_portfolio_graphs(self._portfolio)
+            bump_portfolio_version(self._portfolio)
+            schedule_portfolio_graphs_update(self._portfolio)
 
     def _delete_portfolio_item(self, post: QueryDict):
         form_deleting = PortfolioItemsDeleteForm(self._portfolio, post)
         if form_deleting.is_valid():
             item = form_deleting.cleaned_data['field']
             item.delete()
-            update_portfolio_graphs(self._portfolio)
+            bump_portfolio_version(self._portfolio)
+            schedule_portfolio_graphs_update(self._portfolio)
 
     def _increase_portfolio_item(self, post: QueryDict):
         form_increasing = PortfolioItemsIncreaseQuantityForm(self._portfolio, post)
@@ -86,7 +119,8 @@ class PortfolioItemViewHandler:
             if item.quantity + increment > 0:
                 item.quantity += increment
             item.save()
-            update_portfolio_graphs(self._portfolio)
+            bump_portfolio_version(self._portfolio)
+            schedule_portfolio_graphs_update(self._portfolio)
 
     def _form_items_list(self) -> list[tuple[str, Decimal, str]]:
         items = get_current_portfolio_items(self._portfolio)
@@ -98,7 +132,7 @@ class PortfolioItemViewHandler:
 
     @property
     def items_list(self) -> list[tuple[str, Decimal, str]]:
-        items = self._form_items_list()
+        items = get_cached_portfolio_data(self._portfolio, 'items_list', self._form_items_list)
         return items 
 
     @property
@@ -109,22 +143,214 @@ class PortfolioItemViewHandler:
                 'form_increasing': PortfolioItemsIncreaseQuantityForm(self._portfolio)}
 
 
+class PortfolioItemBatchHandler:
+    # Operations are dicts: {'action': 'create' | 'increase' | 'delete', 'ticker' or 'figi': str, 'quantity': int}.
+    # Either all operations are applied in one transaction with one graphs update or none of them.
+    def __init__(self, portfolio: Portfolio) -> None:
+        self._portfolio = portfolio
+        self._errors = []
+        self._catalog = get_security_catalog()
+        self._items: dict[int, PortfolioItem] = {}
+        self._created: dict[int, PortfolioItem] = {}
+        self._changed: dict[int, PortfolioItem] = {}
+        self._deleted: dict[int, PortfolioItem] = {}
+
+    def apply(self, operations: Iterable[dict]) -> bool:
+        operations = list(operations)
+        self._items = {x.security_id: x for x in PortfolioItem.objects.filter(portfolio=self._portfolio)}
+        for i, operation in enumerate(operations):
+            self._apply_operation(i, operation)
+        if self._errors:
+            return False
+        if self._created or self._changed or self._deleted:
+            self._save()
+            bump_portfolio_version(self._portfolio)
+            schedule_portfolio_graphs_update(self._portfolio)
+        return True
+
+    def apply_formset(self, formset: PortfolioItemBatchFormSet) -> bool:
+        if not formset.is_valid():
+            self._errors.append('Invalid form data')
+            return False
+        return self.apply(x for x in formset.cleaned_data if x)
+
+    def _apply_operation(self, i: int, operation: dict):
+        if not isinstance(operation, dict):
+            self._errors.append(f'{i}: operation must be an object')
+            return
+        action = operation.get('action')
+        key = str(operation.get('ticker') or operation.get('figi') or '')
+        security = self._catalog.find(key)
+        quantity = None
+        if action in BATCH_QUANTITY_FIELDS:
+            try:
+                quantity = BATCH_QUANTITY_FIELDS[action].run_validation(operation.get('quantity'))
+            except serializers.ValidationError as e:
+                self._errors.append(f'{i}: quantity: {" ".join(e.detail)}')
+                return
+        if security is None:
+            self._errors.append(f'{i}: security {key} is not found')
+        elif action == 'create':
+            self._create_item(i, security, quantity)
+        elif action == 'increase':
+            self._increase_item(i, security, quantity)
+        elif action == 'delete':
+            self._delete_item(i, security)
+        else:
+            self._errors.append(f'{i}: unknown action {action}')
+
+    def _create_item(self, i: int, security: SecurityRecord, quantity: int):
+        if security.pk in self._items:
+            self._errors.append(f'{i}: {security.ticker} is already in portfolio')
+        else:
+            item = PortfolioItem(portfolio=self._portfolio, security_id=security.pk, quantity=quantity)
+            self._items[security.pk] = item
+            self._created[security.pk] = item
+
+    def _increase_item(self, i: int, security: SecurityRecord, increment: int):
+        item = self._items.get(security.pk)
+        if item is None:
+            self._errors.append(f'{i}: {security.ticker} is not in portfolio')
+        elif not 0 < item.quantity + increment <= PortfolioItem.MAX_QUANTITY:
+            self._errors.append(f'{i}: {security.ticker} quantity must stay from 1 to {PortfolioItem.MAX_QUANTITY}')
+        else:
+            item.quantity += increment
+            if item.pk is not None:
+                self._changed[security.pk] = item
+
+    def _delete_item(self, i: int, security: SecurityRecord):
+        item = self._items.pop(security.pk, None)
+        if item is None:
+            self._errors.append(f'{i}: {security.ticker} is not in portfolio')
+        elif item.pk is None:
+            del self._created[security.pk]
+        else:
+            self._changed.pop(security.pk, None)
+            self._deleted[security.pk] = item
+
+    @transaction.atomic
+    def _save(self):
+        PortfolioItem.objects.filter(pk__in=[x.pk for x in self._deleted.values()]).delete()
+        PortfolioItem.objects.bulk_update(self._changed.values(), ['quantity'], batch_size=500)
+        PortfolioItem.objects.bulk_create(self._created.values(), batch_size=500)
+
+    @property
+    def errors(self) -> list[str]:
+        return self._errors
+
+
+class TargetAllocationViewHandler:
+    def __init__(self, portfolio: Portfolio) -> None:
+        self._portfolio = portfolio
+
+    def fill_target_forms(self, post: QueryDict):
+        if 'create_target' in post:
+            self._create_target(post)
+        elif 'delete_target' in post:
+            self._delete_target(post)
+
+    def _create_target(self, post: QueryDict):
+        form_creating = TargetAllocationCreateForm(post)
+        if form_creating.is_valid():
+            data = form_creating.cleaned_data
+            TargetAllocation.objects.update_or_create(portfolio=self._portfolio, dimension=data['dimension'],
+                                                      label=data['label'], defaults={'weight': data['weight']})
+
+    def _delete_target(self, post: QueryDict):
+        form_deleting = TargetAllocationDeleteForm(self._portfolio, post)
+        if form_deleting.is_valid():
+            form_deleting.cleaned_data['target'].delete()
+
+    def get_rebalancer_or_none(self, get: QueryDict) -> Optional[PortfolioRebalancer]:
+        form_rebalancing = RebalanceForm(get)
+        if not form_rebalancing.is_valid():
+            return None
+        return PortfolioRebalancer(self._portfolio, form_rebalancing.cleaned_data['dimension'],
+                                   form_rebalancing.cleaned_data['cash'],
+                                   form_rebalancing.cleaned_data['allow_sells'])
+
+    @property
+    def targets(self) -> list[TargetAllocation]:
+        return self._portfolio.targetallocation_set.all()
+
+    @property
+    def empty_forms(self) -> dict[str, Union[TargetAllocationCreateForm, TargetAllocationDeleteForm]]:
+        return {'form_creating': TargetAllocationCreateForm(),
+                'form_deleting': TargetAllocationDeleteForm(self._portfolio)}
+
+
+# Allocation of all user portfolios as one: the same security in several portfolios is merged into one item
+class ConsolidatedAllocation:
+    dimensions = ('sector', 'country', 'market', 'currency')
+
+    def __init__(self, user: SimpleLazyObject):
+        self._items = get_user_consolidated_items(user)
+        self._breakdowns = {}
+        self._total = Decimal(0)
+        self._calculate()
+
+    def _calculate(self):
+        exchanger = Exchanger() if self._items else None
+        for dimension in self.dimensions:
+            calculator = GRAPH_DATA_CALCULATORS[dimension](None, self._items, exchanger)
+            self._total = sum(calculator.costs, Decimal(0))
+            self._breakdowns[dimension] = self._get_rows(calculator.labels, calculator.costs)
+
+    def _get_rows(self, labels: list[str], costs: list[Decimal]) -> list[tuple[str, Decimal, Decimal]]:
+        rows = [(label, _round_money(cost), _round_money(cost / self._total * 100) if self._total else Decimal(0))
+                for label, cost in zip(labels, costs)]
+        return sorted(rows, key=lambda x: x[1], reverse=True)
+
+    @property
+    def breakdowns(self) -> dict[str, list[tuple[str, Decimal, Decimal]]]:
+        return self._breakdowns
+
+    @property
+    def total(self) -> Decimal:
+        return _round_money(self._total)
+
+    @property
+    def positions_count(self) -> int:
+        return len(self._items)
+
+
+def get_user_consolidated_items(user: SimpleLazyObject) -> list[PortfolioItem]:
+    securities = Security.objects.filter(portfolioitem__portfolio__investor=user)\
+        .annotate(total_quantity=Sum('portfolioitem__quantity')).order_by('pk')
+    return [PortfolioItem(security=security, quantity=security.total_quantity) for security in securities]
+
+
+def _round_money(cost: Decimal) -> Decimal:
+    return Decimal(cost).quantize(Decimal('1.01'), rounding=ROUND_HALF_UP)
+
+
 def update_graphs_if_outdated(portfolio: Portfolio):
     if portfolio.last_updated != get_today():
         update_portfolio_graphs(portfolio)
+    else:
+        graph_scheduler.render_if_pending(portfolio)
+
+
+def update_portfolio_graphs(portfolio: Portfolio, is_current: Callable[[], bool] = lambda: True):
+    drawers = get_portfolio_graph_drawers(portfolio)
+    for drawer in drawers:
+        drawer.draw_graph()
+    if not is_current():
+        # Portfolio was edited again while drawing, the newer render will save its graphs
+        for drawer in drawers:
+            drawer.close_graph()
+        return
+    for drawer in drawers:
+        drawer.save_graph()
+
+    update_portfolio_graphs_path(portfolio, [drawer.graph_file_name for drawer in drawers])
+
+
+graph_scheduler = GraphRegenerationScheduler(update_portfolio_graphs)
 
 
-def update_portfolio_graphs(portfolio: Portfolio):
-    # plt.switch_backend('AGG')
-    # TODO: research change graphs type to .svg
-    SecurityGraphDrawer(portfolio).update_graph()
-    SectorGraphDrawer(portfolio).update_graph()
-    CountryGraphDrawer(portfolio).update_graph()
-    MarketGraphDrawer(portfolio).update_graph()
-    CurrencyGraphDrawer(portfolio).update_graph()
-    
-    update_portfolio_graphs_path(portfolio)
-    # update urls path because without updating browser will use old graphs (??cookie??)
+def schedule_portfolio_graphs_update(portfolio: Portfolio):
+    graph_scheduler.schedule(portfolio)
 
 # countries = Security.objects.order_by('country').distinct('country')
 # for i in countries:
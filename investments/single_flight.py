@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from django.core.cache import cache
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[Exception] = None
+
+
+# Concurrent calls with the same key share one call of the function: threads of a process wait for the
+# in-flight call, other processes wait for a cache lock and take the result its holder saved to the cache
+class SingleFlight:
+    def __init__(self, name: str, lock_timeout: float = 30, result_timeout: float = 60, poll_interval: float = 0.05):
+        self._name = name
+        self._lock_timeout = lock_timeout
+        self._result_timeout = result_timeout
+        self._poll_interval = poll_interval
+        self._calls: dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, function: Callable[[], Any]) -> Any:
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+        if not is_leader:
+            return self._wait(call, key, function)
+        try:
+            call.result = self._do_shared(key, function)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            call.done.set()
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def _wait(self, call: _Call, key: str, function: Callable[[], Any]) -> Any:
+        if not call.done.wait(self._lock_timeout):
+            return self._do_shared(key, function)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _do_shared(self, key: str, function: Callable[[], Any]) -> Any:
+        result_key = f'single_flight:{self._name}:{key}:result'
+        lock_key = f'single_flight:{self._name}:{key}:lock'
+        deadline = time.monotonic() + self._lock_timeout
+        while True:
+            result = cache.get(result_key)
+            if result is not None:
+                return result
+            if cache.add(lock_key, True, self._lock_timeout):
+                try:
+                    result = function()
+                    cache.set(result_key, result, self._result_timeout)
+                    return result
+                finally:
+                    cache.delete(lock_key)
+            if time.monotonic() > deadline:
+                # Lock holder is gone without a result
+                return function()
+            time.sleep(self._poll_interval)
@@ -0,0 +1,89 @@
+import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Iterable, Optional
+
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+
+from .models import Portfolio, PortfolioItem, PortfolioSnapshot, Security
+from .exchanger import Exchanger
+from .graph import GRAPH_DATA_CALCULATORS
+from .tinkoff_client import update_security_price
+from .freshness import is_price_fresh
+from .utils import get_today
+from .exceptions import ProviderUnavailable
+
+
+class PortfolioSnapshotWriter:
+    def __init__(self, date: Optional[datetime.date] = None):
+        self._date = date or get_today()
+        self._exchanger: Optional[Exchanger] = None
+        self._items: dict[int, list[PortfolioItem]] = {}
+        self._previous_positions: dict[int, dict] = {}
+
+    def write(self, portfolios: Optional[Iterable[Portfolio]] = None) -> int:
+        portfolios = list(Portfolio.objects.all() if portfolios is None else portfolios)
+        portfolio_pks = [x.pk for x in portfolios]
+        if self._date == get_today():
+            self._update_outdated_prices(portfolio_pks)
+        self._exchanger = Exchanger()
+        self._load_items(portfolio_pks)
+        self._load_previous_positions(portfolio_pks)
+        snapshots = [self._make_snapshot(x) for x in portfolios]
+        with transaction.atomic():
+            PortfolioSnapshot.objects.filter(portfolio__in=portfolio_pks, date=self._date).delete()
+            PortfolioSnapshot.objects.bulk_create(snapshots, batch_size=500)
+        print('$$ Saved', len(snapshots), 'portfolio snapshots for', self._date)
+        return len(snapshots)
+
+    def _update_outdated_prices(self, portfolio_pks: list[int]):
+        securities = Security.objects.filter(portfolioitem__portfolio__in=portfolio_pks).distinct()
+        for security in securities:
+            if not is_price_fresh(security):
+                try:
+                    update_security_price(security)
+                except ProviderUnavailable as e:
+                    print('$$ Snapshot uses stale price:', security.ticker, e)
+
+    def _load_items(self, portfolio_pks: list[int]):
+        items = PortfolioItem.objects.filter(portfolio__in=portfolio_pks).select_related('security') \
+            .order_by('portfolio', 'pk')
+        for item in items.iterator(chunk_size=2000):
+            self._items.setdefault(item.portfolio_id, []).append(item)
+
+    def _load_previous_positions(self, portfolio_pks: list[int]):
+        last_dates = PortfolioSnapshot.objects.filter(portfolio=OuterRef('portfolio'), date__lt=self._date) \
+            .order_by('-date').values('date')[:1]
+        previous = PortfolioSnapshot.objects.filter(portfolio__in=portfolio_pks, date=Subquery(last_dates)) \
+            .values_list('portfolio', 'positions')
+        self._previous_positions = dict(previous)
+
+    def _make_snapshot(self, portfolio: Portfolio) -> PortfolioSnapshot:
+        items = self._items.get(portfolio.pk, [])
+        calculators = {dimension: calculator_class(portfolio, items, self._exchanger)
+                       for dimension, calculator_class in GRAPH_DATA_CALCULATORS.items()}
+        costs = calculators['security'].costs
+        positions = {str(item.security_id): {'quantity': item.quantity, 'price': _round_cost(cost / item.quantity)}
+                     for item, cost in zip(items, costs)}
+        breakdown = {dimension: {label: _round_cost(cost) for label, cost in zip(x.labels, x.costs)}
+                     for dimension, x in calculators.items()}
+        total_value = sum(costs, Decimal(0)).quantize(Decimal('1.01'), rounding=ROUND_HALF_UP)
+        net_flow = _get_net_flow(self._previous_positions.get(portfolio.pk, {}), positions)
+        return PortfolioSnapshot(portfolio=portfolio, date=self._date, total_value=total_value,
+                                 net_flow=Decimal(str(net_flow)), positions=positions, breakdown=breakdown)
+
+
+def _get_net_flow(previous_positions: dict, positions: dict) -> float:
+    # Bought securities are valued at today's price, sold ones at the price of the previous snapshot
+    flow = 0.0
+    for pk, position in positions.items():
+        previous_quantity = previous_positions.get(pk, {}).get('quantity', 0)
+        flow += (position['quantity'] - previous_quantity) * position['price']
+    for pk, position in previous_positions.items():
+        if pk not in positions:
+            flow -= position['quantity'] * position['price']
+    return round(flow, 2)
+
+
+def _round_cost(cost) -> float:
+    return round(float(cost), 4)
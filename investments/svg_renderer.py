@@ -0,0 +1,112 @@
+import math
+from xml.sax.saxutils import escape
+
+from config.settings import GRAPH_SVG_DONUT
+
+# Colors of the default matplotlib cycle, so both renderers look alike
+COLORS = ('#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd',
+          '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf')
+WIDTH = 480
+HEIGHT = 320
+RADIUS = 140
+DONUT_RADIUS = 80
+MIN_PERCENT_SHARE = 0.03
+COMPOSITE_COLUMNS = 3
+TITLE_HEIGHT = 30
+
+
+class SvgPieRenderer:
+    extension = 'svg'
+
+    def __init__(self, donut: bool = GRAPH_SVG_DONUT):
+        self._donut = donut
+        self._svg = None
+
+    def draw(self, labels: list[str], costs: list):
+        self._svg = render_pie_svg(labels, costs, DONUT_RADIUS if self._donut else 0)
+
+    def draw_composite(self, charts: list[tuple[str, list[str], list]]):
+        self._svg = render_composite_svg(charts, DONUT_RADIUS if self._donut else 0)
+
+    def get_content(self) -> bytes:
+        return self._svg.encode()
+
+    def close(self):
+        self._svg = None
+
+    @property
+    def svg(self) -> str:
+        return self._svg
+
+
+def render_pie_svg(labels: list[str], costs: list, inner_radius: float = 0) -> str:
+    return _wrap_svg(WIDTH, HEIGHT, _get_pie_elements(labels, costs, inner_radius))
+
+
+# Pies are placed in a grid of COMPOSITE_COLUMNS columns, each under its title
+def render_composite_svg(charts: list[tuple[str, list[str], list]], inner_radius: float = 0) -> str:
+    rows = math.ceil(len(charts) / COMPOSITE_COLUMNS)
+    elements = []
+    for i, (title, labels, costs) in enumerate(charts):
+        x = i % COMPOSITE_COLUMNS * WIDTH
+        y = i // COMPOSITE_COLUMNS * (HEIGHT + TITLE_HEIGHT)
+        elements.append(f'<g transform="translate({x},{y})">'
+                        f'<text x="{HEIGHT / 2}" y="{TITLE_HEIGHT - 8}" text-anchor="middle" font-size="16">'
+                        f'{escape(title)}</text><g transform="translate(0,{TITLE_HEIGHT})">')
+        elements.extend(_get_pie_elements(labels, costs, inner_radius))
+        elements.append('</g></g>')
+    return _wrap_svg(WIDTH * min(len(charts), COMPOSITE_COLUMNS), rows * (HEIGHT + TITLE_HEIGHT), elements)
+
+
+def _wrap_svg(width: int, height: int, elements: list[str]) -> str:
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="0 0 {width} {height}" font-family="sans-serif" font-size="12">'
+            + ''.join(elements) + '</svg>')
+
+
+def _get_pie_elements(labels: list[str], costs: list, inner_radius: float) -> list[str]:
+    cx = cy = HEIGHT / 2
+    total = float(sum(costs))
+    elements = []
+    angle = 0.0
+    for i, (label, cost) in enumerate(zip(labels, costs)):
+        share = float(cost) / total if total else 0
+        color = COLORS[i % len(COLORS)]
+        if share > 0:
+            elements.append(_get_slice(cx, cy, angle, angle + share * 2 * math.pi, inner_radius, color))
+            if share >= MIN_PERCENT_SHARE:
+                elements.append(_get_percent(cx, cy, angle + share * math.pi, inner_radius, share))
+        elements.append(_get_legend_row(i, label, color))
+        angle += share * 2 * math.pi
+    return elements
+
+
+def _get_point(cx: float, cy: float, radius: float, angle: float) -> str:
+    # Angle is counted clockwise from the top
+    return f'{cx + radius * math.sin(angle):.2f} {cy - radius * math.cos(angle):.2f}'
+
+
+def _get_slice(cx: float, cy: float, start: float, end: float, inner_radius: float, color: str) -> str:
+    if end - start >= 2 * math.pi - 1e-9:
+        # Arc can not start and end in the same point, so the whole circle is drawn with two halves
+        return (_get_slice(cx, cy, 0, math.pi, inner_radius, color)
+                + _get_slice(cx, cy, math.pi, 2 * math.pi, inner_radius, color))
+    large = 1 if end - start > math.pi else 0
+    path = f'M{_get_point(cx, cy, RADIUS, start)}A{RADIUS} {RADIUS} 0 {large} 1 {_get_point(cx, cy, RADIUS, end)}'
+    if inner_radius:
+        path += (f'L{_get_point(cx, cy, inner_radius, end)}'
+                 f'A{inner_radius} {inner_radius} 0 {large} 0 {_get_point(cx, cy, inner_radius, start)}Z')
+    else:
+        path += f'L{cx} {cy}Z'
+    return f'<path d="{path}" fill="{color}" stroke="#fff"/>'
+
+
+def _get_percent(cx: float, cy: float, angle: float, inner_radius: float, share: float) -> str:
+    x, y = _get_point(cx, cy, (RADIUS + inner_radius) / 2 if inner_radius else RADIUS * 0.6, angle).split()
+    return f'<text x="{x}" y="{y}" text-anchor="middle" dominant-baseline="middle">{share * 100:.1f}%</text>'
+
+
+def _get_legend_row(i: int, label: str, color: str) -> str:
+    y = 20 + i * 20
+    return (f'<rect x="{HEIGHT + 10}" y="{y - 10}" width="12" height="12" fill="{color}"/>'
+            f'<text x="{HEIGHT + 28}" y="{y}">{escape(str(label))}</text>')
@@ -1,27 +1,173 @@
+import io
+import json
+import asyncio
 import os
+import tempfile
+import threading
+import time
 import datetime
-from django.test import TestCase
-from config.settings import MEDIA_ROOT
-from .graph import GraphPath
+from xml.etree import ElementTree
+from decimal import Decimal
+from unittest import mock
+
+import numpy as np
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image
+from django.db import OperationalError
+from django.test import TestCase, TransactionTestCase, override_settings
+from aiohttp import web
+from rest_framework.test import APIClient
+from .catalog import get_security_catalog, bump_security_catalog_version
+from .circuit_breaker import CircuitBreaker
+from .covariance import RollingCovariance
+from .exceptions import ExchangeRateNotFound, ProviderUnavailable
+from .exchanger import Exchanger, ExchangeRateHistoryIndex, exchange_rate_circuit
+from .freshness import is_price_fresh
+from .graph import bucket_graph_data
+from .graph_storage import save_graph_content, collect_graph_garbage, get_graph_sources
+from .graph_scheduler import GraphRegenerationScheduler
+from .importer import PortfolioItemsImporter
+from .models import ExchangeRate, ExchangeRateHistory, Portfolio, PortfolioItem, Security, SecurityPriceHistory
+from .performance import get_period_returns, get_time_weighted_returns, get_drawdowns
+from .rebalancing import get_rebalancing_trades
+from .services import get_user_portfolios_totals, ConsolidatedAllocation
+from .risk import simulate_losses, get_risk_measures, PortfolioRiskSimulator
+from .single_flight import SingleFlight
+from .svg_renderer import render_pie_svg, render_composite_svg
+from .tinkoff_client import TinvestPriceHistoryLoader, RequestRateLimiter, process_stock_info, yfapi_circuit
+from .price_history import get_price_history, get_price_history_matrix
+from .price_stream import PriceStreamSubscriber
+from .live_prices import save_live_prices
 from .utils import get_today
+from .versions import bump_portfolio_version, bump_all_portfolios_versions, get_cached_portfolio_data
+from .versions import get_portfolio_cache_key, bump_security_portfolios_versions
+
+
+class TemporaryMediaRootMixin:
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+
+class GraphStorageTests(TemporaryMediaRootMixin, TestCase):
+    def test_same_content_is_saved_once(self):
+        name = save_graph_content(b'<svg/>', 'svg')
+        self.assertEqual(save_graph_content(b'<svg/>', 'svg'), name)
+        self.assertRegex(name, r'^graphs/([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.svg$')
+        self.assertEqual(len(default_storage.listdir(os.path.dirname(name))[1]), 1)
+
+    def test_garbage_collector_keeps_referenced_graphs(self):
+        kept = save_graph_content(b'kept', 'svg')
+        deleted = save_graph_content(b'deleted', 'svg')
+        Portfolio.objects.create(investor=User.objects.create(username='investor'), name='Portfolio',
+                                 securities_graph=kept)
+        self.assertEqual(collect_graph_garbage(datetime.timedelta(hours=1)), 0)
+        self.assertEqual(collect_graph_garbage(datetime.timedelta(0)), 1)
+        self.assertTrue(default_storage.exists(kept))
+        self.assertFalse(default_storage.exists(deleted))
+
+    def test_reused_graph_is_not_collected_before_it_is_referenced(self):
+        name = save_graph_content(b'reused', 'svg')
+        two_hours_ago = time.time() - 2 * 60 * 60
+        os.utime(default_storage.path(name), (two_hours_ago, two_hours_ago))
+        save_graph_content(b'reused', 'svg')
+        self.assertEqual(collect_graph_garbage(datetime.timedelta(hours=1)), 0)
+        self.assertTrue(default_storage.exists(name))
+
+
+class GraphVariantsTests(TemporaryMediaRootMixin, TestCase):
+    def test_png_graph_has_webp_variants(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), 'white').save(buffer, format='PNG')
+        name = save_graph_content(buffer.getvalue(), 'png')
+        portfolio = Portfolio.objects.create(investor=User.objects.create(username='investor'), name='Portfolio',
+                                             sector_graph=name)
+        self.assertEqual(collect_graph_garbage(datetime.timedelta(0)), 0)
+        (content_type, srcset), = get_graph_sources(portfolio, name)['srcsets']
+        self.assertEqual(content_type, 'image/webp')
+        self.client.force_login(portfolio.investor)
+        for source in srcset.split(', '):
+            url, width = source.split()
+            response = self.client.get(url)
+            self.assertEqual(response['Content-Type'], 'image/webp')
+            self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).width, int(width[:-1]))
+
+    def test_missing_variants_are_not_listed_and_made_on_reuse(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), 'white').save(buffer, format='PNG')
+        with mock.patch('investments.graph_storage.render_graph_variants', return_value=[]):
+            name = save_graph_content(buffer.getvalue(), 'png')
+        portfolio = Portfolio.objects.create(investor=User.objects.create(username='investor'), name='Portfolio',
+                                             sector_graph=name)
+        self.assertEqual(get_graph_sources(portfolio, name)['srcsets'], [])
+        save_graph_content(buffer.getvalue(), 'png')
+        self.assertEqual(len(get_graph_sources(portfolio, name)['srcsets']), 1)
+
+
+class PortfolioGraphViewTests(TemporaryMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='investor')
+        self.name = save_graph_content(b'<svg/>', 'svg')
+        self.portfolio = Portfolio.objects.create(investor=self.user, name='Portfolio', sector_graph=self.name)
+        self.url = f'/graph/{self.portfolio.pk}/{os.path.basename(self.name)}'
+        self.client.force_login(self.user)
+
+    def test_graph_is_handed_off_with_cache_headers(self):
+        with mock.patch('investments.graph_storage.GRAPH_SENDFILE_HEADER', 'X-Accel-Redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_if_none_match_compares_whole_etags(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"x{etag[1:-1]}x"').status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='*').status_code, 304)
 
+    def test_other_investor_graph_is_hidden(self):
+        self.client.force_login(User.objects.create(username='other'))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
 
-class GraphPathTests(TestCase):
-    def test_default_work(self):
-        pk = 1
-        graph_type = 'security'
-        gp = GraphPath(pk, graph_type)
-        self.assertEqual(gp.graph_path, os.path.join('portfolio_graph', str(pk), f'{graph_type}_pie.png'))
-        self.assertEqual(gp.graph_full_root, os.path.join(MEDIA_ROOT, 'portfolio_graph', str(pk)))
-        self.assertEqual(gp.graph_full_path, os.path.join(MEDIA_ROOT, 'portfolio_graph', str(pk), f'{graph_type}_pie.png'))
 
-    def test_mixed_arguments(self):
-        pk = 'country'
-        graph_type = 2
-        gp = GraphPath(pk, graph_type)
-        self.assertEqual(gp.graph_path, os.path.join('portfolio_graph', pk, f'{str(graph_type)}_pie.png'))
-        self.assertEqual(gp.graph_full_root, os.path.join(MEDIA_ROOT, 'portfolio_graph', pk))
-        self.assertEqual(gp.graph_full_path, os.path.join(MEDIA_ROOT, 'portfolio_graph', pk, f'{str(graph_type)}_pie.png'))
+class BucketGraphDataTests(TestCase):
+    def test_small_graph_is_unchanged(self):
+        self.assertEqual(bucket_graph_data(['A', 'B'], [1, 3], 5, 0.01), (['A', 'B'], [1, 3]))
+
+    def test_tail_is_folded_into_other(self):
+        labels = ['A', 'B', 'C', 'D', 'E']
+        costs = [Decimal(5), Decimal(50), Decimal('0.5'), Decimal(30), Decimal('14.5')]
+        self.assertEqual(bucket_graph_data(labels, costs, 3, 0.01), (['B', 'D', 'Other'], [50, 30, 20]))
+        self.assertEqual(bucket_graph_data(labels, costs, 10, 0.01), (['B', 'D', 'E', 'A', 'Other'], [50, 30, 14.5, 5, 0.5]))
+
+
+class SvgPieRendererTests(TestCase):
+    def test_pie_and_donut_are_valid_svg(self):
+        for inner_radius in (0, 80):
+            svg = ElementTree.fromstring(render_pie_svg(['A & B', 'C'], [Decimal(3), Decimal(1)], inner_radius))
+            paths = svg.findall('{http://www.w3.org/2000/svg}path')
+            texts = [x.text for x in svg.findall('{http://www.w3.org/2000/svg}text')]
+            self.assertEqual(len(paths), 2)
+            self.assertEqual(texts, ['75.0%', 'A & B', '25.0%', 'C'])
+
+    def test_composite_places_pies_in_grid(self):
+        charts = [(f'Chart {i}', ['A', 'B'], [1, 1]) for i in range(5)]
+        svg = ElementTree.fromstring(render_composite_svg(charts))
+        self.assertEqual((svg.get('width'), svg.get('height')), ('1440', '700'))
+        self.assertEqual(len(svg.findall('.//{http://www.w3.org/2000/svg}path')), 10)
+
+    def test_single_slice_is_whole_circle(self):
+        svg = ElementTree.fromstring(render_pie_svg(['A'], [5]))
+        self.assertEqual(len(svg.findall('{http://www.w3.org/2000/svg}path')), 2)
 
 
 class UtilsGetTodayTests(TestCase):
@@ -29,3 +175,577 @@ class UtilsGetTodayTests(TestCase):
         t = get_today()
         self.assertIsInstance(t, datetime.date)
         self.assertEqual(t, datetime.datetime.utcnow().date())
+
+
+class ExchangeRateHistoryIndexTests(TestCase):
+    def setUp(self):
+        ExchangeRateHistory.objects.bulk_create([
+            ExchangeRateHistory(date=datetime.date(2022, 1, 3), currency='RUB', rate=Decimal('75.0')),
+            ExchangeRateHistory(date=datetime.date(2022, 1, 5), currency='RUB', rate=Decimal('76.0')),
+            ExchangeRateHistory(date=datetime.date(2022, 1, 4), currency='EUR', rate=Decimal('0.88')),
+        ])
+        self.index = ExchangeRateHistoryIndex()
+
+    def test_rate_as_of_date(self):
+        self.assertEqual(self.index.get_rate('RUB', datetime.date(2022, 1, 3)), Decimal('75'))
+        self.assertEqual(self.index.get_rate('RUB', datetime.date(2022, 1, 4)), Decimal('75'))
+        self.assertEqual(self.index.get_rate('RUB', datetime.date(2022, 2, 1)), Decimal('76'))
+        self.assertEqual(self.index.get_rate('USD', datetime.date(2000, 1, 1)), Decimal('1'))
+        with self.assertRaises(ExchangeRateNotFound):
+            self.index.get_rate('EUR', datetime.date(2022, 1, 3))
+
+    def test_bulk_conversion(self):
+        dates = [datetime.date(2022, 1, 2), datetime.date(2022, 1, 4), datetime.date(2022, 1, 6)]
+        converted = self.index.convert_to_usd('RUB', dates, [750.0, 750.0, 760.0])
+        self.assertTrue(np.isnan(converted[0]))
+        np.testing.assert_allclose(converted[1:], [10.0, 10.0])
+
+
+class PriceHistoryTests(TestCase):
+    def setUp(self):
+        self.first = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        self.second = Security.objects.create(ticker='BBB', figi='FIGI0000BBB', name='B', price=20, currency='USD')
+        SecurityPriceHistory.objects.bulk_create([
+            SecurityPriceHistory(security=self.first, date=datetime.date(2022, 1, 3), close_price=Decimal('10')),
+            SecurityPriceHistory(security=self.first, date=datetime.date(2022, 1, 4), close_price=Decimal('11')),
+            SecurityPriceHistory(security=self.second, date=datetime.date(2022, 1, 4), close_price=Decimal('20')),
+        ])
+
+    def test_single_figi_range(self):
+        dates, prices = get_price_history('FIGI0000AAA', datetime.date(2022, 1, 4), datetime.date(2022, 1, 31))
+        self.assertEqual(list(dates), [np.datetime64('2022-01-04')])
+        np.testing.assert_allclose(prices, [11.0])
+
+    def test_matrix_aligns_dates(self):
+        dates, prices = get_price_history_matrix(['FIGI0000BBB', 'FIGI0000AAA'], datetime.date(2022, 1, 1),
+                                                 datetime.date(2022, 1, 31))
+        self.assertEqual(len(dates), 2)
+        self.assertTrue(np.isnan(prices[0, 0]))
+        np.testing.assert_allclose(prices[1], [20.0, 11.0])
+
+
+class TinvestPriceHistoryLoaderTests(TestCase):
+    def setUp(self):
+        self.first = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        self.second = Security.objects.create(ticker='BBB', figi='FIGI0000BBB', name='B', price=20, currency='USD')
+        patcher = mock.patch('investments.tinkoff_client.TinvestClient')
+        self.client = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_requests_span_at_most_one_year_and_failures_are_per_security(self):
+        self.client.get_day_candles.side_effect = \
+            lambda figi, date_from, date_to: self._fail() if figi == 'FIGI0000AAA' else []
+        loader = TinvestPriceHistoryLoader(RequestRateLimiter(max_requests=1000))
+        loader.backfill([self.first, self.second], datetime.date(2019, 1, 1), datetime.date(2021, 12, 31))
+        windows = [x.args[1:] for x in self.client.get_day_candles.call_args_list if x.args[0] == 'FIGI0000BBB']
+        self.assertEqual(windows[0][0], datetime.date(2019, 1, 1))
+        self.assertEqual(windows[-1][1], datetime.date(2021, 12, 31))
+        for (date_from, date_to), next_window in zip(windows, windows[1:] + [None]):
+            self.assertLessEqual((date_to + datetime.timedelta(days=1) - date_from).days, 365)
+            if next_window:
+                self.assertEqual(next_window[0], date_to + datetime.timedelta(days=1))
+
+    def _fail(self):
+        raise requests.ConnectionError('down')
+
+
+class PerformanceTests(TestCase):
+    def test_time_weighted_returns_exclude_flows(self):
+        values = np.array([[100, 110, 220, 198], [50, 50, 50, 50]])
+        flows = np.array([[100, 0, 100, 0], [50, 0, 0, 0]])
+        np.testing.assert_allclose(get_period_returns(values, flows)[0], [0, 0.1, 120 / 110 - 1, -0.1])
+        twr = get_time_weighted_returns(values, flows)
+        np.testing.assert_allclose(twr[0, -1], 1.1 * (120 / 110) * 0.9 - 1)
+        np.testing.assert_allclose(twr[1], [0, 0, 0, 0])
+
+    def test_drawdowns(self):
+        drawdowns = get_drawdowns(np.array([0, 0.2, -0.04, 0.5]))
+        np.testing.assert_allclose(drawdowns[0], [0, 0, -0.2, 0])
+
+
+class RebalancingTests(TestCase):
+    def test_trades_move_to_targets_within_cash(self):
+        prices = np.array([10.0, 50.0, 20.0])
+        quantities = np.array([10, 0, 5])
+        trades = get_rebalancing_trades(prices, quantities, np.array([0, 1, -1]), np.array([50, 50]), cash=100)
+        np.testing.assert_array_equal(trades, [0, 2, 0])
+        self.assertLessEqual(float(np.dot(trades, prices)), 100)
+
+    def test_without_sells_only_buys(self):
+        prices = np.array([10.0, 10.0])
+        trades = get_rebalancing_trades(prices, np.array([20, 0]), np.array([0, 1]), np.array([50, 50]), cash=55,
+                                        allow_sells=False)
+        np.testing.assert_array_equal(trades, [0, 5])
+
+    def test_sells_never_exceed_held_quantity(self):
+        prices = np.array([10.0, 10.0])
+        quantities = np.array([5, 5])
+        trades = get_rebalancing_trades(prices, quantities, np.array([0, 1]), np.array([-50, 150]), cash=0)
+        self.assertTrue((trades >= -quantities).all())
+        rng = np.random.default_rng(1)
+        for _ in range(50):
+            prices = rng.uniform(1, 100, 4)
+            quantities = rng.integers(0, 20, 4)
+            trades = get_rebalancing_trades(prices, quantities, np.arange(4), rng.uniform(-100, 100, 4),
+                                            cash=float(rng.uniform(0, 500)))
+            self.assertTrue((trades >= -quantities).all())
+
+
+class RiskSimulationTests(TestCase):
+    def test_losses_grow_with_horizon(self):
+        returns = np.random.default_rng(1).normal(0, 0.01, size=(250, 3))
+        losses = simulate_losses(returns, np.array([0.5, 0.3, 0.2]), (1, 10), 2000, seed=1, max_workers=2)
+        self.assertEqual(losses.shape, (2000, 2))
+        measures = get_risk_measures(losses, (0.95,))
+        self.assertLess(measures['var_95'][0], measures['var_95'][1])
+        self.assertGreaterEqual(measures['es_95'][1], measures['var_95'][1])
+
+
+class RollingCovarianceTests(TestCase):
+    def test_incremental_updates_match_window(self):
+        returns = np.random.default_rng(2).normal(0, 0.01, size=(40, 3))
+        covariance = RollingCovariance(['A', 'B', 'C'], window=25)
+        covariance.append(returns[:30])
+        covariance.append(returns[30:])
+        self.assertEqual(covariance.count, 25)
+        np.testing.assert_allclose(covariance.get_covariance(), np.cov(returns[-25:], rowvar=False), atol=1e-12)
+        indices = np.array([2, 0])
+        np.testing.assert_allclose(covariance.get_correlation(indices),
+                                   np.corrcoef(returns[-25:, [2, 0]], rowvar=False), atol=1e-9)
+
+
+class GraphRegenerationSchedulerTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='investor')
+        self.portfolio = Portfolio.objects.create(investor=user, name='Portfolio')
+        self.renders = []
+
+    def _render(self, portfolio, is_current):
+        self.renders.append((portfolio.pk, is_current()))
+
+    @override_settings(GRAPH_REGENERATION_DELAY=0.1)
+    def test_burst_of_edits_renders_once(self):
+        scheduler = GraphRegenerationScheduler(self._render)
+        for _ in range(5):
+            scheduler.schedule(self.portfolio)
+        for timer in list(scheduler._timers.values()):
+            timer.join()
+        self.assertEqual(self.renders, [(self.portfolio.pk, True)])
+
+    @override_settings(GRAPH_REGENERATION_DELAY=0)
+    def test_newer_edit_makes_render_stale(self):
+        def render(portfolio, is_current):
+            if not self.renders:
+                self.renders.append(None)
+                scheduler.schedule(portfolio)
+            self._render(portfolio, is_current)
+        scheduler = GraphRegenerationScheduler(render)
+        scheduler.schedule(self.portfolio)
+        self.assertEqual(self.renders, [None, (self.portfolio.pk, True), (self.portfolio.pk, False)])
+
+    @override_settings(GRAPH_REGENERATION_DELAY=60)
+    def test_render_lost_with_its_worker_is_done_by_another(self):
+        recycled_worker = GraphRegenerationScheduler(self._render)
+        recycled_worker.schedule(self.portfolio)
+        for timer in recycled_worker._timers.values():
+            timer.cancel()
+        other_worker = GraphRegenerationScheduler(self._render)
+        other_worker.render_if_pending(self.portfolio)
+        self.assertEqual(self.renders, [])
+        with mock.patch('investments.graph_scheduler.time.time', return_value=time.time() + 61):
+            other_worker.render_if_pending(self.portfolio)
+            GraphRegenerationScheduler(self._render).render_if_pending(self.portfolio)
+        self.assertEqual(self.renders, [(self.portfolio.pk, True)])
+
+    @override_settings(GRAPH_REGENERATION_DELAY=60)
+    def test_lost_render_claimed_by_other_worker_is_skipped(self):
+        GraphRegenerationScheduler(self._render)._set_pending(self.portfolio.pk, 1)
+        cache.set(f'portfolio_graph_generation:{self.portfolio.pk}', 1)
+        cache.add(f'portfolio_graph_pending_claim:{self.portfolio.pk}:1', True)
+        with mock.patch('investments.graph_scheduler.time.time', return_value=time.time() + 61):
+            GraphRegenerationScheduler(self._render).render_if_pending(self.portfolio)
+        self.assertEqual(self.renders, [])
+
+
+class PortfolioItemsImporterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='investor')
+        self.portfolio = Portfolio.objects.create(investor=user, name='Portfolio')
+        self.first = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        self.second = Security.objects.create(ticker='BBB', figi='FIGI0000BBB', name='B', price=20, currency='USD')
+        PortfolioItem.objects.create(portfolio=self.portfolio, security=self.first, quantity=1)
+
+    def test_upsert_and_sum_lots(self):
+        content = 'Ticker;FIGI;Quantity\nAAA;;5\n;FIGI0000BBB;2\nBBB;;3\nZZZ;;1\n'.encode()
+        importer = PortfolioItemsImporter(self.portfolio)
+        self.assertFalse(importer.import_file(SimpleUploadedFile('items.csv', content)))
+        self.assertEqual(importer.imported_rows, 3)
+        self.assertEqual(len(importer.errors), 1)
+        quantities = dict(PortfolioItem.objects.values_list('security__ticker', 'quantity'))
+        self.assertEqual(quantities, {'AAA': 5, 'BBB': 5})
+
+    def test_fractional_and_out_of_range_quantities_are_row_errors(self):
+        content = 'Ticker;Quantity\nAAA;1.7\nAAA;inf\nAAA;1e400\nBBB;2147483647\nBBB;1\n'.encode()
+        importer = PortfolioItemsImporter(self.portfolio)
+        self.assertFalse(importer.import_file(SimpleUploadedFile('items.csv', content)))
+        self.assertEqual(len(importer.errors), 4)
+        self.assertIn('not a whole number', importer.errors[0])
+        quantities = dict(PortfolioItem.objects.values_list('security__ticker', 'quantity'))
+        self.assertEqual(quantities, {'AAA': 1, 'BBB': 2147483647})
+
+
+class PortfolioItemBatchEditTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user(username='investor', password='password')
+        self.portfolio = Portfolio.objects.create(investor=user, name='Portfolio')
+        Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        self.client.force_login(user)
+
+    def test_invalid_quantities_are_rejected_per_operation(self):
+        body = '{"operations": [{"action": "create", "ticker": "AAA", "quantity": 1.9}, ' \
+               '{"action": "create", "ticker": "AAA", "quantity": Infinity}, ' \
+               '{"action": "create", "ticker": "AAA", "quantity": 0}]}'
+        response = self.client.post(f'/batch-edit/{self.portfolio.pk}', body, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 3)
+        self.assertFalse(PortfolioItem.objects.exists())
+
+
+class PortfolioApiTests(TestCase):
+    def setUp(self):
+        user = User.objects.create(username='investor')
+        self.portfolio = Portfolio.objects.create(investor=user, name='Portfolio')
+        self.security = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        patcher = mock.patch('investments.utils.is_price_fresh', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_conditional_get_until_items_change(self):
+        url = f'/api/portfolios/{self.portfolio.pk}/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with mock.patch('investments.api.schedule_portfolio_graphs_update') as schedule:
+            response = self.client.post(f'/api/portfolios/{self.portfolio.pk}/items/',
+                                        {'security': self.security.pk, 'quantity': 3})
+        self.assertEqual(response.status_code, 201)
+        schedule.assert_called_once()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_outdated_price_is_refreshed_before_etag(self):
+        PortfolioItem.objects.create(portfolio=self.portfolio, security=self.security, quantity=1)
+        ExchangeRate.objects.create(pk=1, eur_rate=Decimal('0.9'), rub_rate=Decimal('60'))
+        url = f'/api/portfolios/{self.portfolio.pk}/allocations/'
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=f'"other", W/{etag}').status_code, 304)
+        with mock.patch('investments.utils.is_price_fresh', return_value=False), \
+                mock.patch('investments.utils.update_security_price',
+                           side_effect=lambda x: bump_security_portfolios_versions([x.pk])):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_other_investor_portfolio_is_hidden(self):
+        other = Portfolio.objects.create(investor=User.objects.create(username='other'), name='Other')
+        self.assertEqual(self.client.get(f'/api/portfolios/{other.pk}/').status_code, 404)
+        self.assertEqual(self.client.get(f'/api/portfolios/{other.pk}/items/').status_code, 404)
+
+
+class PortfolioExportTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='investor', password='password')
+        self.portfolio = Portfolio.objects.create(investor=user, name='Portfolio')
+        security = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='EUR')
+        PortfolioItem.objects.create(portfolio=self.portfolio, security=security, quantity=3)
+        ExchangeRate.objects.create(pk=1, eur_rate=Decimal('0.5'), rub_rate=Decimal('60'))
+        self.client.force_login(user)
+
+    def test_holdings_are_streamed_as_csv_and_json(self):
+        response = self.client.get(f'/export/holdings/{self.portfolio.pk}')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="holdings.csv"')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines, ['portfolio,ticker,figi,name,currency,quantity,price,cost,cost_usd',
+                                 'Portfolio,AAA,FIGI0000AAA,A,EUR,3,10.0000,30.00,60.00'])
+        response = self.client.get(f'/export/holdings/{self.portfolio.pk}', {'format': 'json'})
+        rows = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([(x['ticker'], x['cost_usd']) for x in rows], [('AAA', '60.00')])
+
+    def test_unknown_kind_and_other_investor_portfolio_are_not_found(self):
+        self.assertEqual(self.client.get(f'/export/unknown/{self.portfolio.pk}').status_code, 404)
+        other = Portfolio.objects.create(investor=User.objects.create(username='other'), name='Other')
+        self.assertEqual(self.client.get(f'/export/holdings/{other.pk}').status_code, 404)
+        self.assertEqual(self.client.get('/export/holdings/100500').status_code, 404)
+
+
+class PortfolioCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.portfolio = Portfolio.objects.create(investor=User.objects.create(username='investor'), name='Portfolio')
+        self.calculations = 0
+
+    def _calculate(self):
+        self.calculations += 1
+        return self.calculations
+
+    def test_data_is_cached_until_version_changes(self):
+        self.assertEqual(get_cached_portfolio_data(self.portfolio, 'data', self._calculate), 1)
+        self.assertEqual(get_cached_portfolio_data(self.portfolio, 'data', self._calculate), 1)
+        bump_portfolio_version(self.portfolio)
+        self.assertEqual(get_cached_portfolio_data(self.portfolio, 'data', self._calculate), 2)
+        bump_all_portfolios_versions()
+        self.portfolio.refresh_from_db()
+        self.assertEqual(get_cached_portfolio_data(self.portfolio, 'data', self._calculate), 3)
+
+
+class PortfolioPagePricesTests(TemporaryMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        user = User.objects.create_user(username='investor', password='password')
+        self.portfolio = Portfolio.objects.create(investor=user, name='Portfolio')
+        security = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD',
+                                           sector='TECH', country='United States')
+        PortfolioItem.objects.create(portfolio=self.portfolio, security=security, quantity=1)
+        ExchangeRate.objects.create(pk=1, eur_rate=Decimal('0.9'), rub_rate=Decimal('60'))
+        self.client.force_login(user)
+
+    def test_stale_prices_are_refreshed_when_summary_is_cached(self):
+        with mock.patch('investments.utils.is_price_fresh', return_value=False), \
+                mock.patch('investments.utils.update_security_price') as update_security_price:
+            for _ in range(3):
+                self.assertEqual(self.client.get(f'/{self.portfolio.pk}').status_code, 200)
+        self.assertGreaterEqual(update_security_price.call_count, 3)
+
+    def test_risk_report_computed_after_first_view_is_shown(self):
+        with mock.patch('investments.utils.is_price_fresh', return_value=True):
+            self.assertNotContains(self.client.get(f'/{self.portfolio.pk}'), 'risk-report')
+            with mock.patch.object(PortfolioRiskSimulator, '_simulate', return_value={'rows': [(1, 0.01, 0.02)]}):
+                PortfolioRiskSimulator(self.portfolio).get_report()
+            self.assertContains(self.client.get(f'/{self.portfolio.pk}'), 'risk-report')
+
+    def test_stale_prices_are_flagged_and_not_cached(self):
+        with mock.patch('investments.utils.is_price_fresh', return_value=False), \
+                mock.patch('investments.utils.update_security_price', side_effect=ProviderUnavailable('down')):
+            response = self.client.get(f'/{self.portfolio.pk}')
+        self.assertContains(response, 'Last known prices are shown for AAA')
+        self.portfolio.refresh_from_db()
+        self.assertIsNone(cache.get(get_portfolio_cache_key(self.portfolio, 'items_list')))
+        with mock.patch('investments.utils.is_price_fresh', return_value=True):
+            self.assertNotContains(self.client.get(f'/{self.portfolio.pk}'), 'Last known prices')
+        self.assertIsNotNone(cache.get(get_portfolio_cache_key(self.portfolio, 'items_list')))
+
+
+class UserPortfoliosTotalsTests(TestCase):
+    def setUp(self):
+        ExchangeRate.objects.create(pk=1, eur_rate=Decimal('0.5'), rub_rate=Decimal('100'))
+        self.user = User.objects.create(username='investor')
+        usd = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        rub = Security.objects.create(ticker='BBB', figi='FIGI0000BBB', name='B', price=500, currency='RUB')
+        eur = Security.objects.create(ticker='CCC', figi='FIGI0000CCC', name='C', price=4, currency='EUR')
+        first = Portfolio.objects.create(investor=self.user, name='First')
+        PortfolioItem.objects.create(portfolio=first, security=usd, quantity=2)
+        PortfolioItem.objects.create(portfolio=first, security=rub, quantity=4)
+        second = Portfolio.objects.create(investor=self.user, name='Second')
+        PortfolioItem.objects.create(portfolio=second, security=eur, quantity=3)
+        Portfolio.objects.create(investor=self.user, name='Empty')
+
+    def test_totals_in_one_query(self):
+        portfolios = get_user_portfolios_totals(self.user)
+        with self.assertNumQueries(1):
+            totals = [(x.name, x.total_value, x.positions_count) for x in portfolios]
+        self.assertEqual(totals, [('First', Decimal(40), 2), ('Second', Decimal(24), 1), ('Empty', Decimal(0), 0)])
+
+    def test_missing_exchange_rate_is_requested_before_totals(self):
+        ExchangeRate.objects.all().delete()
+        response = mock.Mock()
+        response.json.return_value = {'conversion_rates': {'EUR': 0.5, 'RUB': 100}}
+        with mock.patch('investments.exchanger.requests.get', return_value=response):
+            totals = [(x.name, x.total_value) for x in get_user_portfolios_totals(self.user)]
+        self.assertEqual(totals, [('First', Decimal(40)), ('Second', Decimal(24)), ('Empty', Decimal(0))])
+
+    def test_consolidated_allocation_merges_securities(self):
+        third = Portfolio.objects.create(investor=self.user, name='Third')
+        PortfolioItem.objects.create(portfolio=third, security=Security.objects.get(ticker='AAA'), quantity=1)
+        with mock.patch('investments.services.Exchanger') as exchanger:
+            exchanger.return_value.eur_rate = Decimal('0.5')
+            exchanger.return_value.rub_rate = Decimal('100')
+            allocation = ConsolidatedAllocation(self.user)
+        self.assertEqual(allocation.positions_count, 3)
+        self.assertEqual(allocation.total, Decimal(74))
+        self.assertEqual(allocation.breakdowns['currency'],
+                         [('USD', Decimal(30), Decimal('40.54')), ('EUR', Decimal(24), Decimal('32.43')),
+                          ('RUB', Decimal(20), Decimal('27.03'))])
+
+
+class SecurityCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+
+    def test_catalog_is_reloaded_after_version_bump(self):
+        catalog = get_security_catalog()
+        self.assertEqual(catalog.find('FIGI0000AAA').ticker, 'AAA')
+        with self.assertNumQueries(0):
+            self.assertIs(get_security_catalog(), catalog)
+        security = Security.objects.create(ticker='BBB', figi='FIGI0000BBB', name='B', price=20, currency='USD')
+        self.assertIsNone(get_security_catalog().find('BBB'))
+        bump_security_catalog_version()
+        self.assertEqual(get_security_catalog().find('BBB').pk, security.pk)
+
+
+class PriceFreshnessTests(TestCase):
+    def _get_security(self, updated_at: datetime.datetime, sector: str = 'TECH') -> Security:
+        return Security(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD', sector=sector,
+                        price_updated_at=updated_at)
+
+    def test_closed_market_price_is_fresh_after_last_close(self):
+        saturday = datetime.datetime(2022, 6, 4, 12, tzinfo=datetime.timezone.utc)
+        after_close = datetime.datetime(2022, 6, 3, 21, tzinfo=datetime.timezone.utc)
+        before_close = datetime.datetime(2022, 6, 3, 19, tzinfo=datetime.timezone.utc)
+        self.assertTrue(is_price_fresh(self._get_security(after_close), saturday))
+        self.assertFalse(is_price_fresh(self._get_security(before_close), saturday))
+
+    def test_open_market_price_uses_type_ttl(self):
+        now = datetime.datetime(2022, 6, 3, 15, tzinfo=datetime.timezone.utc)
+        updated_at = now - datetime.timedelta(minutes=30)
+        self.assertFalse(is_price_fresh(self._get_security(updated_at), now))
+        self.assertTrue(is_price_fresh(self._get_security(updated_at, 'BOND'), now))
+
+
+class PriceStreamSubscriberTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.portfolio = Portfolio.objects.create(investor=User.objects.create(username='investor'), name='Portfolio')
+        self.security = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        self.item = PortfolioItem.objects.create(portfolio=self.portfolio, security=self.security, quantity=1)
+        self.events = []
+
+    async def _handle_ws(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for message in ws:
+            event = message.json()
+            self.events.append((event['event'], event['figi']))
+            if event['event'] == 'candle:subscribe':
+                await ws.send_json({'event': 'candle', 'payload': {'figi': event['figi']}})
+                await ws.send_json({'event': 'candle', 'payload': {'figi': event['figi'], 'c': 12.5}})
+        return ws
+
+    async def _run_stream(self):
+        app = web.Application()
+        app.router.add_get('/ws', self._handle_ws)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        subscriber = PriceStreamSubscriber(f'http://127.0.0.1:{port}/ws', 'token', 0.05, 0.05)
+        task = asyncio.create_task(subscriber.run())
+        await asyncio.wait_for(subscriber.wait_ready(), 5)
+        await self._wait_for(lambda: cache.get('live_price:FIGI0000AAA') is not None)
+        await asyncio.to_thread(self.item.delete)
+        await self._wait_for(lambda: len(self.events) == 2)
+        subscriber.stop()
+        await asyncio.wait_for(task, 5)
+        await runner.cleanup()
+
+    def _fail_once(self, function):
+        calls = []
+
+        def wrapper(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return function(*args)
+        return wrapper
+
+    async def _wait_for(self, condition, timeout: float = 5):
+        async def poll():
+            while not condition():
+                await asyncio.sleep(0.01)
+        await asyncio.wait_for(poll(), timeout)
+
+    # The stream outlives a malformed event and a failed flush
+    def test_prices_are_flushed_and_subscriptions_follow_holdings(self):
+        with mock.patch('investments.price_stream.save_live_prices', side_effect=self._fail_once(save_live_prices)):
+            asyncio.run(self._run_stream())
+        self.security.refresh_from_db()
+        self.assertEqual(self.security.price, Decimal('12.5'))
+        self.assertIsNotNone(self.security.price_updated_at)
+        self.assertEqual(cache.get('live_price:FIGI0000AAA')[0], Decimal('12.5'))
+        self.assertEqual(self.events, [('candle:subscribe', 'FIGI0000AAA'), ('candle:unsubscribe', 'FIGI0000AAA')])
+
+
+class SingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def _refresh(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return self.calls
+
+    def test_concurrent_calls_share_one_refresh(self):
+        single_flight = SingleFlight('test')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(single_flight.do('FIGI', self._refresh)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((self.calls, results), (1, [1] * 5))
+
+    def test_other_worker_result_is_taken_from_cache(self):
+        single_flight = SingleFlight('test', lock_timeout=5)
+        cache.add('single_flight:test:FIGI:lock', True)
+        timer = threading.Timer(0.2, lambda: cache.set('single_flight:test:FIGI:result', 42))
+        timer.start()
+        self.assertEqual(single_flight.do('FIGI', self._refresh), 42)
+        timer.join()
+        self.assertEqual(self.calls, 0)
+
+
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker('test', failure_rate=0.5, min_calls=2, window=60, open_timeout=60)
+
+    def _fail(self):
+        raise requests.ConnectionError('down')
+
+    def test_open_circuit_fails_fast_until_probe_succeeds(self):
+        for _ in range(2):
+            with self.assertRaises(ProviderUnavailable):
+                self.breaker.call(self._fail)
+        self.assertTrue(self.breaker.is_open)
+        probe = mock.Mock(return_value=1)
+        with self.assertRaises(ProviderUnavailable):
+            self.breaker.call(probe)
+        probe.assert_not_called()
+        with mock.patch('investments.circuit_breaker.time.time', return_value=time.time() + 61):
+            self.assertEqual(self.breaker.call(probe), 1)
+        self.assertFalse(self.breaker.is_open)
+
+    def test_exchanger_serves_last_known_rates_when_provider_is_down(self):
+        ExchangeRate.objects.create(pk=1, eur_rate=Decimal('0.9'), rub_rate=Decimal('60'))
+        ExchangeRate.objects.filter(pk=1).update(last_updated=get_today() - datetime.timedelta(days=1))
+        with mock.patch('investments.exchanger.requests.get', side_effect=requests.ConnectionError('down')):
+            exchanger = Exchanger()
+        self.assertTrue(exchanger.is_stale)
+        self.assertEqual(exchanger.eur_rate, Decimal('0.90'))
+        exchange_rate_circuit.reset()
+
+
+    def test_stock_info_run_is_not_used_up_when_yfapi_is_down(self):
+        stock = Security.objects.create(ticker='AAA', figi='FIGI0000AAA', name='A', price=10, currency='USD')
+        with mock.patch('investments.tinkoff_client.requests.get', side_effect=requests.ConnectionError('down')), \
+                mock.patch('investments.tinkoff_client.update_yahoo_api_using_date') as update_yahoo_api_using_date:
+            process_stock_info([stock])
+        update_yahoo_api_using_date.assert_not_called()
+        yfapi_circuit.reset()
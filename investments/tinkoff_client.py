@@ -1,30 +1,55 @@
 import time
 import requests
+from collections import deque
 from typing import Optional, List
-from datetime import datetime
+from datetime import datetime, date, time as dt_time, timedelta, timezone
 from dateutil.parser import parse
 from decimal import Decimal
 
 from django.http.request import QueryDict
-from tinvest import SyncClient
-from tinvest.exceptions import TooManyRequestsError, UnexpectedError
+from django.utils import timezone as django_timezone
+from tinvest import SyncClient, CandleResolution
+from tinvest.exceptions import TooManyRequestsError, UnexpectedError, TinvestError
 from tinvest.clients import MarketInstrumentListResponse
+from tinvest.schemas import Candle
 
-from config.settings import TINVEST_TOKEN, YAHOO_API_KEY, MEDIA_ROOT
+from config.settings import TINVEST_TOKEN, YAHOO_API_KEY, MEDIA_ROOT, PROVIDER_TIMEOUT
 from .models import Security
 from .forms import SecurityFillInformationForm
-from .exceptions import StockNotFound
+from .exceptions import StockNotFound, ProviderUnavailable
+from .price_history import record_security_price, save_price_history, get_last_price_date
+from .versions import bump_security_portfolios_versions
+from .catalog import get_security_catalog, bump_security_catalog_version
+from .single_flight import SingleFlight
+from .circuit_breaker import CircuitBreaker
 
 # TODO: add Model LastUpdate for monthly updating Securities and daily updating YAHOO API using
 
+tinvest_circuit = CircuitBreaker('Tinvest')
+yfapi_circuit = CircuitBreaker('yfapi', ignore=(StockNotFound,))
+
+
+# SyncClient does not take a timeout, so the session sets it for every request
+class TimeoutSession(requests.Session):
+    def request(self, *args, **kwargs):
+        kwargs.setdefault('timeout', PROVIDER_TIMEOUT)
+        return super().request(*args, **kwargs)
+
+
 class TinvestClient:
     def __init__(self) -> None:
-        self._client = SyncClient(TINVEST_TOKEN)
+        self._client = SyncClient(TINVEST_TOKEN, session=TimeoutSession())
 
     def get_security_price(self, figi: str) -> Decimal:
         order_book = self._client.get_market_orderbook(figi, 1)
         return order_book.payload.close_price
 
+    def get_day_candles(self, figi: str, date_from: date, date_to: date) -> list[Candle]:
+        from_ = datetime.combine(date_from, dt_time.min, tzinfo=timezone.utc)
+        to = datetime.combine(date_to + timedelta(days=1), dt_time.min, tzinfo=timezone.utc)
+        response = self._client.get_market_candles(figi, from_, to, CandleResolution.day)
+        return response.payload.candles
+
     def get_etfs(self) -> MarketInstrumentListResponse:
         return self._client.get_market_etfs()
 
@@ -35,17 +60,75 @@ class TinvestClient:
         return self._client.get_market_stocks()
 
 
+class RequestRateLimiter:
+    # Sliding window: at most max_requests calls per period seconds
+    def __init__(self, max_requests: int = 100, period: float = 60) -> None:
+        self._max_requests = max_requests
+        self._period = period
+        self._calls = deque()
+
+    def wait(self):
+        now = time.monotonic()
+        while self._calls and now - self._calls[0] >= self._period:
+            self._calls.popleft()
+        if len(self._calls) >= self._max_requests:
+            time.sleep(self._period - (now - self._calls[0]))
+            self._calls.popleft()
+        self._calls.append(time.monotonic())
+
+
+class TinvestPriceHistoryLoader:
+    # Tinvest returns at most one year of day candles per request. Window end date is inclusive and requested up to
+    # the next midnight, so a window of start + 364 days spans exactly 365 days
+    _max_candles_period = timedelta(days=364)
+
+    def __init__(self, limiter: Optional[RequestRateLimiter] = None) -> None:
+        self._client = TinvestClient()
+        self._limiter = limiter or RequestRateLimiter()
+
+    def backfill(self, securities: list[Security], date_from: date, date_to: date, incremental: bool = True):
+        length = len(securities) - 1
+        for i, security in enumerate(securities):
+            start = date_from
+            if incremental:
+                last_date = get_last_price_date(security)
+                if last_date is not None and last_date >= start:
+                    start = last_date + timedelta(days=1)
+            try:
+                saved = self._load_security_history(security, start, date_to)
+            except (TinvestError, requests.RequestException) as e:
+                # One failed security does not stop the backfill of the others
+                print(i, '/', length, '(' + str(security.ticker) + ')')
+                print('ERROR:', e)
+            else:
+                print(i, '/', length, '(' + str(security.ticker) + ')', '- saved', saved, 'candles')
+
+    def _load_security_history(self, security: Security, date_from: date, date_to: date) -> int:
+        saved = 0
+        start = date_from
+        while start <= date_to:
+            end = min(start + self._max_candles_period, date_to)
+            candles = self._request_day_candles(security.figi, start, end)
+            saved += save_price_history(security, ((x.time.date(), x.c) for x in candles))
+            start = end + timedelta(days=1)
+        return saved
+
+    def _request_day_candles(self, figi: str, date_from: date, date_to: date) -> list[Candle]:
+        self._limiter.wait()
+        try:
+            return self._client.get_day_candles(figi, date_from, date_to)
+        except TooManyRequestsError:
+            time.sleep(60)
+            return self._client.get_day_candles(figi, date_from, date_to)
+
+
 class TinvestSerucityCreator:
     def __init__(self) -> None:
         self._client = TinvestClient()
         self._data: MarketInstrumentListResponse
 
     def _get_all_tickers(self) -> List[str]:
-        securities = Security.objects.all()
-        tickers = []
-        for row in securities:
-            tickers.append(row.ticker)
-        return tickers
+        return get_security_catalog().tickers
 
     def _define_ticker(self, ticker: str, security_type: str, currency: str) -> str:
         if security_type == 'Stock':
@@ -152,7 +235,8 @@ class TinvestSerucityCreator:
                 self._print_process_securities_error(row, i, length, new_ticker, e)
             else:
                 self._print_process_securities_success(i, length, new_ticker)
-    
+        bump_security_catalog_version()
+
     def create_etfs(self):
         self._data = self._client.get_etfs()
         self._process_securities()
@@ -171,11 +255,26 @@ class TinvestSerucityCreator:
         self.create_stocks()
 
 
+# One refresh of a FIGI at a time across all workers, the others take its price
+price_refreshes = SingleFlight('security_price')
+
+
 def update_security_price(security: Security):
-    new_price = TinvestClient().get_security_price(security.figi)
-    security.price = new_price
-    security.save()
-    print('$$ Update security:', security.ticker, '-', security.price, security.currency)
+    security.price, security.price_updated_at = price_refreshes.do(security.figi,
+                                                                   lambda: _refresh_security_price(security))
+    security.last_updated = security.price_updated_at.date()
+
+
+def _refresh_security_price(security: Security) -> tuple[Decimal, datetime]:
+    new_price = tinvest_circuit.call(lambda: TinvestClient().get_security_price(security.figi))
+    updated_at = django_timezone.now()
+    # Only price fields are written, so concurrent edits of other security fields are kept
+    Security.objects.filter(pk=security.pk).update(price=new_price, price_updated_at=updated_at,
+                                                   last_updated=updated_at.date())
+    record_security_price(security, updated_at.date(), new_price)
+    bump_security_portfolios_versions([security.pk])
+    print('$$ Update security:', security.ticker, '-', new_price, security.currency)
+    return new_price, updated_at
 
 
 def get_not_found_stock() -> Optional[Security]:
@@ -200,6 +299,7 @@ def save_not_found_stock_info(not_found_stock: Security, post: QueryDict):
 def delete_not_found_stock_and_add_to_stop_list(not_found_stock: Security):
     add_to_stock_stop_list(not_found_stock.ticker)
     not_found_stock.delete()
+    bump_security_catalog_version()
 
 
 def get_normalized_stock_ticker(ticker: str, currency: str) -> str:
@@ -239,10 +339,15 @@ def process_stock_info(stocks: list[Security]):
         except StockNotFound as e:
             mark_security_as_not_found(row)
             print(e)
-        except requests.ConnectionError as e:
-            print('ConnectionError:', e)
+        except ProviderUnavailable as e:
+            if isinstance(e.__cause__, requests.HTTPError):
+                # yfapi answered with an error, the day's requests are used as before
+                print(e)
+                break
+            # Open circuit or no connection: the run is retried later today
+            print('ProviderUnavailable:', e)
             return
-        except (requests.HTTPError, Exception) as e:
+        except Exception as e:
             print(e)
             break
         else:
@@ -303,6 +408,10 @@ def print_save_stock_success(ticker: str, sector: str, country: str):
 
 
 def get_stock_info_or_error(ticker: str) -> dict:
+    return yfapi_circuit.call(lambda: _request_stock_info(ticker))
+
+
+def _request_stock_info(ticker: str) -> dict:
     url = f'https://yfapi.net/v11/finance/quoteSummary/{ticker}'
     options = {
         'modules': 'assetProfile'
@@ -311,7 +420,7 @@ def get_stock_info_or_error(ticker: str) -> dict:
         'accept': 'application/json',
         'x-api-key': YAHOO_API_KEY
     }
-    response = requests.get(url=url, params=options, headers=headers)
+    response = requests.get(url=url, params=options, headers=headers, timeout=PROVIDER_TIMEOUT)
     response.raise_for_status()
     return unpack_stock_info(response, ticker)
 
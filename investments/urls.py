@@ -1,11 +1,29 @@
-from django.urls import path
-from . import views
+from django.urls import path, include
+from rest_framework import routers
+from . import api, views
+
+router = routers.DefaultRouter()
+router.register('portfolios', api.PortfolioViewSet, basename='api_portfolio')
+router.register('securities', api.SecurityViewSet, basename='api_security')
+portfolio_items = api.PortfolioItemViewSet.as_view({'get': 'list', 'post': 'create'})
+portfolio_item = api.PortfolioItemViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+                                                   'delete': 'destroy'})
 
 
 urlpatterns = [
     path('', views.index_page, name='index'),
     path('<int:portfolio_pk>', views.portfolio_page, name='portfolio'),
+    path('batch-edit/<int:portfolio_pk>', views.batch_edit_portfolio_page, name='batch_edit'),
+    path('import/<int:portfolio_pk>', views.import_portfolio_page, name='import_portfolio'),
+    path('graph/<int:portfolio_pk>/<str:file_name>', views.portfolio_graph_page, name='portfolio_graph'),
+    path('consolidated', views.consolidated_page, name='consolidated'),
+    path('export/<str:kind>', views.export_page, name='export'),
+    path('export/<str:kind>/<int:portfolio_pk>', views.export_page, name='export_portfolio'),
+    path('rebalance/<int:portfolio_pk>', views.rebalance_page, name='rebalance'),
     path('delete-portfolio/<int:portfolio_pk>', views.delete_portfolio_page, name='delete_portfolio'),
     path('superuser-dashboard', views.superuser_dashboard, name='superuser_dashboard'),
-    path('delete-not-found/<int:security_pk>', views.delete_not_found_stock, name='delete_not_found')
+    path('delete-not-found/<int:security_pk>', views.delete_not_found_stock, name='delete_not_found'),
+    path('api/portfolios/<int:portfolio_pk>/items/', portfolio_items, name='api_portfolio_items'),
+    path('api/portfolios/<int:portfolio_pk>/items/<int:pk>/', portfolio_item, name='api_portfolio_item'),
+    path('api/', include(router.urls))
 ]
@@ -1,18 +1,45 @@
 import datetime
-from .models import Portfolio, PortfolioItem
+from typing import Iterable
+
+from .models import Portfolio, PortfolioItem, Security
 from .tinkoff_client import update_security_price
+from .freshness import is_price_fresh
+from .live_prices import apply_live_price
+from .exceptions import ProviderUnavailable
+from .versions import mark_portfolio_data_stale
 
 
 def get_current_portfolio_items(portfolio: Portfolio) -> list[PortfolioItem]:
     items = _get_portfolio_items(portfolio)
-    for item in items:
-        if item.security.last_updated != get_today():
-            update_security_price(item.security)
+    refresh_outdated_prices(items)
     return items
 
 
+# Cached page data is keyed by the portfolio version, so prices are checked before it is served:
+# a refreshed price bumps the version and the cached data is calculated again
+def refresh_portfolio_prices(portfolio: Portfolio) -> list[Security]:
+    stale_securities = refresh_outdated_prices(_get_portfolio_items(portfolio))
+    portfolio.refresh_from_db(fields=['version'])
+    return stale_securities
+
+
+# Returns securities whose refresh failed: their last known price is kept and shown as stale
+def refresh_outdated_prices(items: Iterable[PortfolioItem]) -> list[Security]:
+    stale_securities = []
+    for item in items:
+        if not is_price_fresh(item.security) and not apply_live_price(item.security):
+            try:
+                update_security_price(item.security)
+            except ProviderUnavailable as e:
+                print('$$ Price is stale:', item.security.ticker, e)
+                stale_securities.append(item.security)
+    if stale_securities:
+        mark_portfolio_data_stale()
+    return stale_securities
+
+
 def _get_portfolio_items(portfolio: Portfolio) -> list[PortfolioItem]:
-    return portfolio.portfolioitem_set.all()
+    return portfolio.portfolioitem_set.select_related('security')
 
 
 def get_today() -> datetime.date:
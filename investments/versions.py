@@ -0,0 +1,69 @@
+from contextvars import ContextVar
+from typing import Any, Callable, Iterable
+
+from django.core.cache import cache
+from django.http.request import HttpRequest
+from django.utils.http import parse_etags
+from django.db.models import F, Count, Max, Sum
+
+from .models import Portfolio
+
+PORTFOLIO_CACHE_TIMEOUT = 60 * 60 * 24
+# Set when a calculation used last known rates or prices because a provider failed
+_is_data_stale = ContextVar('is_data_stale', default=False)
+
+
+def bump_portfolio_version(portfolio: Portfolio):
+    Portfolio.objects.filter(pk=portfolio.pk).update(version=F('version') + 1)
+    portfolio.refresh_from_db(fields=['version'])
+
+
+def bump_security_portfolios_versions(security_pks: Iterable[int]):
+    Portfolio.objects.filter(pk__in=Portfolio.objects.filter(portfolioitem__security__in=list(security_pks))
+                             .values('pk')).update(version=F('version') + 1)
+
+
+def bump_all_portfolios_versions():
+    Portfolio.objects.update(version=F('version') + 1)
+
+
+def get_portfolio_etag(portfolio: Portfolio) -> str:
+    return f'"{portfolio.pk}-{portfolio.version}"'
+
+
+# If-None-Match uses the weak comparison: W/ prefixes are ignored and * matches any representation
+def is_etag_matched(request: HttpRequest, etag: str) -> bool:
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    return '*' in etags or etag in {x.removeprefix('W/') for x in etags}
+
+
+def get_portfolio_cache_key(portfolio: Portfolio, name: str) -> str:
+    return f'portfolio:{portfolio.pk}:{portfolio.version}:{name}'
+
+
+def mark_portfolio_data_stale():
+    _is_data_stale.set(True)
+
+
+def get_cached_portfolio_data(portfolio: Portfolio, name: str, calculate: Callable[[], Any]) -> Any:
+    # Calculation may refresh outdated prices and bump the version, so the result is saved under the new one.
+    # Data built from stale rates or prices is not saved: the version does not change when the provider is back
+    data = cache.get(get_portfolio_cache_key(portfolio, name))
+    if data is None:
+        token = _is_data_stale.set(False)
+        try:
+            data = calculate()
+            is_stale = _is_data_stale.get()
+        finally:
+            _is_data_stale.reset(token)
+        portfolio.refresh_from_db(fields=['version'])
+        if is_stale:
+            mark_portfolio_data_stale()
+        else:
+            cache.set(get_portfolio_cache_key(portfolio, name), data, PORTFOLIO_CACHE_TIMEOUT)
+    return data
+
+
+def get_user_portfolios_version(user) -> str:
+    versions = Portfolio.objects.filter(investor=user).aggregate(count=Count('pk'), last=Max('pk'), sum=Sum('version'))
+    return f'{versions["count"]}-{versions["last"]}-{versions["sum"]}'
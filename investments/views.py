@@ -1,9 +1,25 @@
+import json
+
+from django.http import JsonResponse, Http404
 from django.shortcuts import render, get_object_or_404, redirect
+from django.utils.functional import SimpleLazyObject
 from django.contrib.auth.decorators import login_required, user_passes_test
 
+from config.settings import GRAPH_COMPOSITE
 from .models import Portfolio, Security
+from .performance import PortfolioPerformance
+from .risk import get_cached_risk_report
+from .forms import RebalanceForm, PortfolioItemBatchFormSet, PortfolioItemsImportForm
+from .exports import EXPORTS, get_export_response
+from .importer import PortfolioItemsImporter
+from .graph_storage import get_graph_sources, get_portfolio_graph_name, get_graph_response
 from .services import PortfolioItemViewHandler, update_graphs_if_outdated, delete_portfolio
-from .services import get_user_portfolios_list, get_empty_creating_portfolio_form, create_portfolio
+from .services import TargetAllocationViewHandler, PortfolioItemBatchHandler, schedule_portfolio_graphs_update
+from .services import ConsolidatedAllocation
+from .services import get_user_portfolios_totals, get_empty_creating_portfolio_form, create_portfolio
+from .utils import get_today, refresh_portfolio_prices
+from .exchanger import Exchanger
+from .versions import bump_portfolio_version, get_user_portfolios_version
 from .tinkoff_client import auto_define_stock_info, TinvestSerucityCreator
 from .tinkoff_client import get_not_found_stock, get_empty_fill_info_form_or_none, save_not_found_stock_info
 from .tinkoff_client import delete_not_found_stock_and_add_to_stop_list, auto_define_bonds_info
@@ -11,7 +27,8 @@ from .tinkoff_client import delete_not_found_stock_and_add_to_stop_list, auto_de
 
 def index_page(request):
     if request.user.is_authenticated:
-        portfolios_list = get_user_portfolios_list(request.user)
+        portfolios_list = get_user_portfolios_totals(request.user)
+        portfolios_version = get_user_portfolios_version(request.user)
         form_creating = get_empty_creating_portfolio_form()
 
         if request.method == 'POST':
@@ -19,10 +36,12 @@ def index_page(request):
             return redirect('index')
     else:
         portfolios_list = None
+        portfolios_version = None
         form_creating = None
 
     index_page_data = {
         'portfolios': portfolios_list,
+        'portfolios_version': portfolios_version,
         'form_creating': form_creating
     }
 
@@ -39,16 +58,23 @@ def portfolio_page(request, portfolio_pk):
             return redirect('portfolio', portfolio_pk=portfolio.pk)
 
         forms = PortfolioItemViewHandler(portfolio).empty_forms
-        securities = PortfolioItemViewHandler(portfolio).items_list
         update_graphs_if_outdated(portfolio)
+        stale_securities = refresh_portfolio_prices(portfolio)
 
         portfolio_page_data = {
-            'securities': securities,
-            'securities_graph': portfolio.securities_graph,
-            'sector_graph': portfolio.sector_graph,
-            'country_graph': portfolio.country_graph,
-            'market_graph': portfolio.market_graph,
-            'currency_graph': portfolio.currency_graph,
+            'securities': SimpleLazyObject(lambda: PortfolioItemViewHandler(portfolio).items_list),
+            'performance': SimpleLazyObject(lambda: PortfolioPerformance(portfolio)),
+            'risk_report': SimpleLazyObject(lambda: get_cached_risk_report(portfolio) or {}),
+            'portfolio_version': portfolio.version,
+            'today': get_today(),
+            'composite_graph': GRAPH_COMPOSITE,
+            'stale_prices': [x.ticker for x in stale_securities],
+            'stale_rates': Exchanger().is_stale,
+            'securities_graph': get_graph_sources(portfolio, portfolio.securities_graph.name),
+            'sector_graph': get_graph_sources(portfolio, portfolio.sector_graph.name),
+            'country_graph': get_graph_sources(portfolio, portfolio.country_graph.name),
+            'market_graph': get_graph_sources(portfolio, portfolio.market_graph.name),
+            'currency_graph': get_graph_sources(portfolio, portfolio.currency_graph.name),
             'form_creating': forms['form_creating'],
             'form_deleting': forms['form_deleting'],
             'form_increasing': forms['form_increasing'],
@@ -60,6 +86,127 @@ def portfolio_page(request, portfolio_pk):
         return redirect('index')
 
 
+@login_required(login_url='login')
+def batch_edit_portfolio_page(request, portfolio_pk):
+    portfolio = get_object_or_404(Portfolio, pk=portfolio_pk)
+
+    if portfolio.investor == request.user:
+        formset = PortfolioItemBatchFormSet()
+        errors = []
+        if request.method == 'POST':
+            handler = PortfolioItemBatchHandler(portfolio)
+            if request.content_type == 'application/json':
+                try:
+                    operations = json.loads(request.body)['operations']
+                except (ValueError, KeyError, TypeError):
+                    return JsonResponse({'errors': ['Body must be {"operations": [...]}']}, status=400)
+                if not isinstance(operations, list) or not handler.apply(operations):
+                    return JsonResponse({'errors': handler.errors or ['Operations must be a list']}, status=400)
+                return JsonResponse({'applied': len(operations)})
+
+            formset = PortfolioItemBatchFormSet(request.POST)
+            if handler.apply_formset(formset):
+                return redirect('portfolio', portfolio_pk=portfolio.pk)
+            errors = handler.errors
+
+        batch_edit_data = {
+            'portfolio': portfolio,
+            'formset': formset,
+            'errors': errors
+        }
+
+        return render(request, 'investments/batch_edit.html', batch_edit_data)
+    else:
+        return redirect('index')
+
+
+@login_required(login_url='login')
+def import_portfolio_page(request, portfolio_pk):
+    portfolio = get_object_or_404(Portfolio, pk=portfolio_pk)
+
+    if portfolio.investor == request.user:
+        form_importing = PortfolioItemsImportForm()
+        importer = None
+        if request.method == 'POST':
+            form_importing = PortfolioItemsImportForm(request.POST, request.FILES)
+            if form_importing.is_valid():
+                importer = PortfolioItemsImporter(portfolio)
+                imported = importer.import_file(request.FILES['file'])
+                if importer.imported_rows:
+                    bump_portfolio_version(portfolio)
+                    schedule_portfolio_graphs_update(portfolio)
+                if imported:
+                    return redirect('portfolio', portfolio_pk=portfolio.pk)
+
+        import_page_data = {
+            'portfolio': portfolio,
+            'form_importing': form_importing,
+            'importer': importer
+        }
+
+        return render(request, 'investments/import_portfolio.html', import_page_data)
+    else:
+        return redirect('index')
+
+
+@login_required(login_url='login')
+def rebalance_page(request, portfolio_pk):
+    portfolio = get_object_or_404(Portfolio, pk=portfolio_pk)
+
+    if portfolio.investor == request.user:
+        handler = TargetAllocationViewHandler(portfolio)
+        if request.method == 'POST':
+            handler.fill_target_forms(request.POST)
+            return redirect('rebalance', portfolio_pk=portfolio.pk)
+
+        forms = handler.empty_forms
+        rebalance_page_data = {
+            'portfolio': portfolio,
+            'targets': handler.targets,
+            'rebalancer': handler.get_rebalancer_or_none(request.GET),
+            'form_rebalancing': RebalanceForm(request.GET or None),
+            'form_creating': forms['form_creating'],
+            'form_deleting': forms['form_deleting']
+        }
+
+        return render(request, 'investments/rebalance.html', rebalance_page_data)
+    else:
+        return redirect('index')
+
+
+@login_required(login_url='login')
+def portfolio_graph_page(request, portfolio_pk, file_name):
+    portfolio = get_object_or_404(Portfolio, pk=portfolio_pk, investor=request.user)
+    name = get_portfolio_graph_name(portfolio, file_name)
+    if name is None:
+        raise Http404
+    return get_graph_response(request, name)
+
+
+@login_required(login_url='login')
+def consolidated_page(request):
+    consolidated_page_data = {
+        'allocation': SimpleLazyObject(lambda: ConsolidatedAllocation(request.user)),
+        'portfolios_version': get_user_portfolios_version(request.user)
+    }
+
+    return render(request, 'investments/consolidated.html', consolidated_page_data)
+
+
+@login_required(login_url='login')
+def export_page(request, kind, portfolio_pk=None):
+    if kind not in EXPORTS:
+        raise Http404
+    if portfolio_pk is not None:
+        portfolio = get_object_or_404(Portfolio, pk=portfolio_pk, investor=request.user)
+        portfolios = Portfolio.objects.filter(pk=portfolio.pk)
+    elif request.user.is_superuser and 'all' in request.GET:
+        portfolios = Portfolio.objects.all()
+    else:
+        portfolios = Portfolio.objects.filter(investor=request.user)
+    return get_export_response(kind, portfolios, request.GET.get('format', 'csv'))
+
+
 @login_required(login_url='login')
 def delete_portfolio_page(request, portfolio_pk):
     portfolio = get_object_or_404(Portfolio, pk=portfolio_pk)